@@ -0,0 +1,27 @@
+"""Add image_tasks indexes
+
+Revision ID: 4f2a9c1e7b3d
+Revises: bdd8d5d616c6
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4f2a9c1e7b3d'
+down_revision: Union[str, None] = 'bdd8d5d616c6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_image_tasks_user_id_created_at', 'image_tasks', ['user_id', 'created_at', 'id'], unique=False)
+    op.create_index(op.f('ix_image_tasks_task_id'), 'image_tasks', ['task_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_image_tasks_task_id'), table_name='image_tasks')
+    op.drop_index('ix_image_tasks_user_id_created_at', table_name='image_tasks')
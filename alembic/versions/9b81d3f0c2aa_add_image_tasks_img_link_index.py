@@ -0,0 +1,25 @@
+"""Add image_tasks img_link index
+
+Revision ID: 9b81d3f0c2aa
+Revises: 4f2a9c1e7b3d
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9b81d3f0c2aa'
+down_revision: Union[str, None] = '4f2a9c1e7b3d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(op.f('ix_image_tasks_img_link'), 'image_tasks', ['img_link'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_image_tasks_img_link'), table_name='image_tasks')
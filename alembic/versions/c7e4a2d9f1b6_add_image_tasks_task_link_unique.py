@@ -0,0 +1,29 @@
+"""Add unique image_tasks (task_id, img_link) index
+
+Revision ID: c7e4a2d9f1b6
+Revises: 9b81d3f0c2aa
+Create Date: 2026-10-18 20:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c7e4a2d9f1b6'
+down_revision: Union[str, None] = '9b81d3f0c2aa'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute(
+        "DELETE FROM image_tasks a USING image_tasks b "
+        "WHERE a.task_id = b.task_id AND a.img_link = b.img_link AND a.id > b.id"
+    )
+    op.create_index('uq_image_tasks_task_id_img_link', 'image_tasks', ['task_id', 'img_link'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index('uq_image_tasks_task_id_img_link', table_name='image_tasks')
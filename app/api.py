@@ -1,15 +1,28 @@
-from fastapi import APIRouter, File, UploadFile, Depends, HTTPException
-from fastapi.responses import StreamingResponse
+import asyncio
+import mimetypes
+from celery import states
+from fastapi import APIRouter, File, Form, UploadFile, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import RedirectResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
-from typing import List
-from app import security, tasks, image_processing
-from app.db import User, get_user_history
-from app.schemas import UserCreate, Token, ImageTaskCreate, ImageTaskResponse, StatusResponse, IDResponse
+from starlette.background import BackgroundTask
+from os import getenv
+from typing import AsyncIterator, Dict, List, Optional
+from uuid import uuid4
+from app import archives, dedup, derived, events, http_cache, metrics, scheduling, security, tasks
+from app.ingest import MAX_UPLOAD_FILE_BYTES, MAX_UPLOAD_FILES, file_size, sniff_image
+from app.transforms import DEFAULT_ENCODER_PRESET, ENCODER_PRESETS, VARIANTS, resolve_variants
+from app.storage import STAGING_PREFIX, ObjectInfo, get_storage
+from app.db import get_task_links, get_user_history, image_link_exists, save_tasks_to_db
+from app.schemas import (CurrentUser, UserCreate, Token, ImageTaskCreate, ImageTaskResponse, StatusResponse, IDResponse,
+                         TaskToDatabase, DedupStatsResponse, ImageURLResponse, BulkStatusRequest, QueueStatsResponse)
 
 router = APIRouter()
 
 ALLOWED_EXTENSIONS = {'jpg', 'jpeg', 'png'}
 
+LAZY_VARIANTS = getenv('LAZY_VARIANTS', '0') == '1'
+MAX_STATUS_BATCH = int(getenv('MAX_STATUS_BATCH', 500))
+
 
 @router.post("/registration", response_model=Token)
 async def register(user: UserCreate) -> Token:
@@ -27,49 +40,251 @@ def allowed_file(filename: str) -> bool:
 
 @router.post("/upload", response_model=ImageTaskCreate)
 async def upload_images(files: List[UploadFile] = File(...),
-                        user: User = Depends(security.get_user_from_token)) -> ImageTaskCreate:
+                        variants: Optional[List[str]] = Form(None),
+                        lazy: bool = Form(LAZY_VARIANTS),
+                        preset: str = Form(DEFAULT_ENCODER_PRESET),
+                        user: CurrentUser = Depends(security.get_user_from_token)) -> ImageTaskCreate:
     if user:
-        task_id = ''
+        try:
+            variants = resolve_variants(['original'] if lazy else variants)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if preset not in ENCODER_PRESETS:
+            raise HTTPException(status_code=400, detail=f"Unknown preset: {preset}")
+
+        if len(files) > MAX_UPLOAD_FILES:
+            raise HTTPException(status_code=400, detail=f"Too many files, at most {MAX_UPLOAD_FILES} are allowed.")
+
+        sizes, pixels = [], []
         for file in files:
             if not allowed_file(file.filename):
                 raise HTTPException(
                     status_code=400,
                     detail="Invalid file type. Only .jpg and .png files are allowed."
                 )
+            size = file.size if file.size is not None else await asyncio.to_thread(file_size, file.file)
+            if size > MAX_UPLOAD_FILE_BYTES:
+                raise HTTPException(status_code=413, detail=f"File {file.filename} is too large.")
+            try:
+                header = await asyncio.to_thread(sniff_image, file.file)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=f"Invalid image {file.filename}: {e}")
+            sizes.append(size)
+            pixels.append(header.width * header.height)
+
+        wait = await scheduling.admit(user.id, scheduling.estimate_cost(pixels, variants))
+        if wait > 0:
+            raise HTTPException(
+                status_code=429,
+                detail="Upload rate limit exceeded",
+                headers={"Retry-After": scheduling.retry_after(wait)}
+            )
+
+        specs = {variant: VARIANTS[variant] for variant in variants}
+        task_id = str(uuid4())
+        items = []
+        queued_sizes, queued_pixels = [], []
+        for file, size, file_pixels in zip(files, sizes, pixels):
+            digest = await asyncio.to_thread(dedup.content_hash_stream, file.file)
+            links = await asyncio.to_thread(dedup.lookup_variants, digest, specs, preset)
+            if len(links) == len(specs):
+                items.append({'digest': digest, 'image_links': [links[variant] for variant in specs]})
+                continue
+
+            staging_key = f"{STAGING_PREFIX}{uuid4()}"
+            await get_storage().put_fileobj(staging_key, file.file)
+            items.append({'digest': digest, 'staging_key': staging_key})
+            queued_sizes.append(size)
+            queued_pixels.append(file_pixels)
 
-            file_bytes = await file.read()
-            async_result = tasks.process_image.delay(file_bytes, user.id)
-            task_id = async_result.task_id
+        if all('image_links' in item for item in items):
+            image_links = [link for item in items for link in item['image_links']]
+            await save_tasks_to_db(TaskToDatabase(task_id=task_id, image_links=image_links, user_id=user.id))
+            await asyncio.to_thread(tasks.mark_task_done, task_id, len(items))
+        else:
+            queue = scheduling.task_queue(scheduling.estimate_cost(queued_pixels, variants), sum(queued_sizes))
+            tasks.process_images.apply_async((items, user.id, variants, preset), task_id=task_id, queue=queue)
 
         return ImageTaskCreate(task_id=task_id)
 
 
+def status_response(status: str, info: Dict) -> StatusResponse:
+    return StatusResponse(
+        task_status=status,
+        done=info.get('done'),
+        total=info.get('total'),
+        preset=info.get('preset'),
+        output_bytes=info.get('output_bytes'),
+        encode_seconds=info.get('encode_seconds')
+    )
+
+
+def check_status_batch(task_ids: List[str]):
+    if not task_ids or len(task_ids) > MAX_STATUS_BATCH:
+        raise HTTPException(status_code=400, detail=f"Between 1 and {MAX_STATUS_BATCH} task ids are allowed.")
+
+
 @router.get("/status/{task_id}", response_model=StatusResponse)
-async def get_status(task_id: str, user: User = Depends(security.get_user_from_token)) -> StatusResponse:
+async def get_status(task_id: str, user: CurrentUser = Depends(security.get_user_from_token)) -> StatusResponse:
     if user:
-        status = tasks.get_task_status(task_id)
-        return StatusResponse(task_status=status)
+        status, info = await asyncio.to_thread(tasks.get_task_progress, task_id)
+        return status_response(status, info)
+
+
+@router.post("/status", response_model=Dict[str, StatusResponse])
+async def get_bulk_status(request: BulkStatusRequest,
+                          user: CurrentUser = Depends(security.get_user_from_token)) -> Dict[str, StatusResponse]:
+    if user:
+        check_status_batch(request.task_ids)
+        progress = await asyncio.to_thread(tasks.get_tasks_progress, request.task_ids)
+        return {task_id: status_response(*progress[task_id]) for task_id in request.task_ids}
+
+
+async def task_event_stream(task_ids: List[str]) -> AsyncIterator[str]:
+    pending = set(task_ids)
+    last_sent: Dict[str, Dict] = {}
+
+    def render(task_id: str, status: str, info: Dict) -> Optional[str]:
+        payload = {'task_id': task_id, **status_response(status, info).model_dump(exclude_none=True)}
+        previous = last_sent.get(task_id)
+        if previous == payload or (previous and status == states.PENDING):
+            return None
+        last_sent[task_id] = payload
+        if status in events.TERMINAL_STATES:
+            pending.discard(task_id)
+        return events.format_sse(payload)
+
+    async def reconcile() -> List[str]:
+        progress = await asyncio.to_thread(tasks.get_tasks_progress, sorted(pending))
+        messages = [render(task_id, status, info) for task_id, (status, info) in progress.items()]
+        return [message for message in messages if message]
+
+    async with events.subscribe(task_ids) as next_event:
+        for message in await reconcile():
+            yield message
+        while pending:
+            event = await next_event()
+            if event is None:
+                yield ": keepalive\n\n"
+                for message in await reconcile():
+                    yield message
+            elif event.get('task_id') in pending:
+                message = render(event['task_id'], event['task_status'], event)
+                if message:
+                    yield message
+
+
+@router.get("/events")
+async def stream_task_events(task_id: List[str] = Query(...),
+                             user: CurrentUser = Depends(security.get_user_from_token)) -> StreamingResponse:
+    if user:
+        check_status_batch(task_id)
+        return StreamingResponse(
+            task_event_stream(list(dict.fromkeys(task_id))),
+            media_type='text/event-stream',
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+
+
+@router.get("/dedup/stats", response_model=DedupStatsResponse)
+async def get_dedup_stats(user: CurrentUser = Depends(security.get_user_from_token)) -> DedupStatsResponse:
+    if user:
+        stats = await asyncio.to_thread(dedup.get_stats)
+        return DedupStatsResponse(**stats)
+
+
+@router.get("/queues/stats", response_model=Dict[str, QueueStatsResponse])
+async def get_queue_stats(user: CurrentUser = Depends(security.get_user_from_token)) -> Dict[str, QueueStatsResponse]:
+    if user:
+        stats = await asyncio.to_thread(scheduling.get_queue_stats)
+        return {queue: QueueStatsResponse(**values) for queue, values in stats.items()}
+
+
+@router.get("/metrics", include_in_schema=False)
+async def get_metrics() -> Response:
+    return Response(await asyncio.to_thread(metrics.render_metrics), media_type=metrics.CONTENT_TYPE_LATEST)
 
 
 @router.get("/get_my_id", response_model=IDResponse)
-async def get_my_id(user: User = Depends(security.get_user_from_token)) -> IDResponse:
+async def get_my_id(user: CurrentUser = Depends(security.get_user_from_token)) -> IDResponse:
     if user:
         return IDResponse(your_id=user.id)
 
 
 @router.get("/history/{user_id}", response_model=List[ImageTaskResponse])
-async def get_history(user_id: str, user: User = Depends(security.get_user_from_token)) -> List[ImageTaskResponse]:
+async def get_history(user_id: str, response: Response,
+                      limit: int = Query(100, ge=1, le=1000),
+                      cursor: Optional[str] = None,
+                      user: CurrentUser = Depends(security.get_user_from_token)) -> List[ImageTaskResponse]:
     if user:
-        history = await get_user_history(user_id)
+        history, next_cursor = await get_user_history(user_id, limit, cursor)
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
         return history
 
 
+def storage_body(key: str) -> http_cache.Body:
+    return lambda start, end: get_storage().iter_chunks(key, start, end)
+
+
 @router.get("/task/{task_id}", response_class=StreamingResponse)
-async def download_task_images(task_id: str, user: User = Depends(security.get_user_from_token)) -> StreamingResponse:
+async def download_task_images(task_id: str, request: Request,
+                               user: CurrentUser = Depends(security.get_user_from_token)) -> Response:
     if user:
-        zip_buffer = await image_processing.download_images_zip(task_id)
-        return StreamingResponse(
-            zip_buffer,
-            media_type='application/zip',
-            headers={"Content-Disposition": f"attachment; filename={task_id}.zip"}
-        )
+        headers = {"Content-Disposition": f"attachment; filename={task_id}.zip"}
+        archive = await archives.get_archive(task_id)
+        if archive is not None:
+            return http_cache.cached_response(request, archive, storage_body(archive.key), 'application/zip',
+                                              http_cache.ARCHIVE_CACHE_CONTROL, headers)
+
+        download = await archives.download_images_zip(task_id)
+        return StreamingResponse(download.chunks(), media_type='application/zip', headers=headers,
+                                 background=BackgroundTask(download.store))
+
+
+@router.get("/task/{task_id}/urls", response_model=List[ImageURLResponse])
+async def get_task_image_urls(task_id: str,
+                              user: CurrentUser = Depends(security.get_user_from_token)) -> List[ImageURLResponse]:
+    if user:
+        img_links = await get_task_links(task_id)
+        if not img_links:
+            raise HTTPException(status_code=404, detail="Task not found")
+        storage = get_storage()
+        return [
+            ImageURLResponse(img_link=img_link, url=storage.presigned_url(img_link) or f"/image/{img_link}")
+            for img_link in img_links
+        ]
+
+
+@router.get("/image/{img_link}")
+async def download_image(img_link: str, request: Request, redirect: bool = False, op: Optional[str] = None,
+                         user: CurrentUser = Depends(security.get_user_from_token)) -> Response:
+    if user:
+        if op is not None and op not in VARIANTS:
+            raise HTTPException(status_code=400, detail=f"Unknown variant: {op}")
+        if not await image_link_exists(img_link):
+            raise HTTPException(status_code=404, detail="Image not found")
+
+        storage = get_storage()
+        if op is not None:
+            try:
+                key, data = await derived.get_variant(img_link, op)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=f"Invalid image {img_link}: {e}")
+            url = storage.presigned_url(key) if redirect else None
+            if url:
+                return RedirectResponse(url, status_code=307)
+            info = ObjectInfo(key, len(data), http_cache.content_etag(data), None)
+            return http_cache.cached_response(request, info, http_cache.bytes_body(data),
+                                              mimetypes.guess_type(key)[0] or 'application/octet-stream')
+
+        if redirect:
+            url = storage.presigned_url(img_link)
+            if url:
+                return RedirectResponse(url, status_code=307)
+
+        info = await storage.head(img_link)
+        if info is None:
+            raise HTTPException(status_code=404, detail="Image not found")
+        return http_cache.cached_response(request, info, storage_body(img_link),
+                                          mimetypes.guess_type(img_link)[0] or 'application/octet-stream')
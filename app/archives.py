@@ -0,0 +1,112 @@
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime
+from os import getenv
+from tempfile import SpooledTemporaryFile
+from typing import AsyncIterator, Iterable, List, Optional, Tuple
+from app.db import get_task_images
+from app.metrics import observe_zip
+from app.storage import ObjectInfo, get_storage
+from app.zip_stream import stream_zip
+
+logger = logging.getLogger(__name__)
+
+ZIP_FETCH_CONCURRENCY = int(getenv('ZIP_FETCH_CONCURRENCY', 4))
+PRECOMPUTE_ARCHIVES = getenv('PRECOMPUTE_ARCHIVES', '0') == '1'
+STORE_ARCHIVES_ON_DOWNLOAD = getenv('STORE_ARCHIVES_ON_DOWNLOAD', '1') == '1'
+ARCHIVE_SPOOL_BYTES = int(getenv('ARCHIVE_SPOOL_BYTES', 32 * 1024 * 1024))
+
+ARCHIVE_PREFIX = 'archives/'
+
+
+def archive_key(task_id: str) -> str:
+    return f"{ARCHIVE_PREFIX}{task_id}.zip"
+
+
+async def fetch_images(img_names: Iterable[str], concurrency: int) -> AsyncIterator[Tuple[str, bytes]]:
+    names = iter(img_names)
+    pending = deque()
+
+    def schedule():
+        img_name = next(names, None)
+        if img_name is not None:
+            pending.append((img_name, asyncio.create_task(get_storage().get(img_name))))
+
+    try:
+        for _ in range(max(concurrency, 1)):
+            schedule()
+        while pending:
+            img_name, download = pending.popleft()
+            img_data = await download
+            schedule()
+            yield img_name, img_data
+    finally:
+        for _, download in pending:
+            download.cancel()
+
+
+def build_zip(img_links: List[str], modified: Optional[datetime] = None) -> AsyncIterator[bytes]:
+    return observe_zip(stream_zip(fetch_images(img_links, ZIP_FETCH_CONCURRENCY), modified))
+
+
+class ArchiveDownload:
+    def __init__(self, task_id: str, img_links: List[str], modified: Optional[datetime]):
+        self.key = archive_key(task_id)
+        self.img_links = img_links
+        self.modified = modified
+        self.complete = False
+        self.spool = None
+        if STORE_ARCHIVES_ON_DOWNLOAD and img_links:
+            self.spool = SpooledTemporaryFile(max_size=ARCHIVE_SPOOL_BYTES)
+
+    async def chunks(self) -> AsyncIterator[bytes]:
+        async for chunk in build_zip(self.img_links, self.modified):
+            if self.spool is not None:
+                await asyncio.to_thread(self.spool.write, chunk)
+            yield chunk
+        self.complete = True
+
+    async def store(self):
+        if self.spool is None:
+            return
+        try:
+            if self.complete and await get_storage().head(self.key) is None:
+                self.spool.seek(0)
+                await get_storage().put_fileobj(self.key, self.spool)
+        except Exception:
+            logger.warning("Storing archive %s failed", self.key, exc_info=True)
+        finally:
+            self.spool.close()
+
+
+async def download_images_zip(task_id: str) -> ArchiveDownload:
+    img_links, created_at = await get_task_images(task_id)
+    return ArchiveDownload(task_id, img_links, created_at)
+
+
+async def get_archive(task_id: str) -> Optional[ObjectInfo]:
+    return await get_storage().head(archive_key(task_id))
+
+
+async def store_archive(task_id: str) -> Optional[str]:
+    img_links, created_at = await get_task_images(task_id)
+    if not img_links:
+        return None
+    key = archive_key(task_id)
+    with SpooledTemporaryFile(max_size=ARCHIVE_SPOOL_BYTES) as spool:
+        async for chunk in build_zip(img_links, created_at):
+            await asyncio.to_thread(spool.write, chunk)
+        spool.seek(0)
+        await get_storage().put_fileobj(key, spool)
+    return key
+
+
+async def precompute_archive(task_id: str) -> Optional[str]:
+    if not PRECOMPUTE_ARCHIVES:
+        return None
+    try:
+        return await store_archive(task_id)
+    except Exception:
+        logger.warning("Building archive for task %s failed", task_id, exc_info=True)
+        return None
@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from os import getenv
+from typing import Any, Optional, Set
+import redis.asyncio as redis
+from sqlalchemy import event
+from app.db import User
+from app.schemas import CurrentUser
+
+logger = logging.getLogger(__name__)
+
+AUTH_CACHE_TTL = float(getenv('AUTH_CACHE_TTL', 30))
+AUTH_CACHE_SIZE = int(getenv('AUTH_CACHE_SIZE', 10000))
+AUTH_CACHE_REDIS_URL = getenv('AUTH_CACHE_REDIS_URL')
+AUTH_CACHE_REDIS_TTL = int(getenv('AUTH_CACHE_REDIS_TTL', 300))
+
+KEY_PREFIX = 'auth:principal:'
+
+
+class TTLCache:
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any):
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+_local = TTLCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL)
+_redis: Optional[redis.Redis] = None
+_pending_invalidations: Set[asyncio.Task] = set()
+
+
+def get_redis() -> Optional[redis.Redis]:
+    global _redis
+    if AUTH_CACHE_REDIS_URL and _redis is None:
+        _redis = redis.Redis.from_url(AUTH_CACHE_REDIS_URL)
+    return _redis
+
+
+async def get_principal(user_id: str) -> Optional[CurrentUser]:
+    principal = _local.get(user_id)
+    if principal is not None:
+        return principal
+
+    client = get_redis()
+    if client is None:
+        return None
+    try:
+        value = await client.get(f"{KEY_PREFIX}{user_id}")
+    except redis.RedisError:
+        logger.warning("Auth cache lookup failed", exc_info=True)
+        return None
+    if value is None:
+        return None
+    principal = CurrentUser.model_validate_json(value)
+    _local.set(user_id, principal)
+    return principal
+
+
+async def set_principal(principal: CurrentUser):
+    _local.set(principal.id, principal)
+    client = get_redis()
+    if client is None:
+        return
+    try:
+        await client.set(f"{KEY_PREFIX}{principal.id}", principal.model_dump_json(), ex=AUTH_CACHE_REDIS_TTL)
+    except redis.RedisError:
+        logger.warning("Auth cache update failed", exc_info=True)
+
+
+async def invalidate(user_id: str):
+    _local.delete(user_id)
+    client = get_redis()
+    if client is None:
+        return
+    try:
+        await client.delete(f"{KEY_PREFIX}{user_id}")
+    except redis.RedisError:
+        logger.warning("Auth cache invalidation failed", exc_info=True)
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def invalidate_changed_user(mapper, connection, target: User):
+    _local.delete(target.id)
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    task = loop.create_task(invalidate(target.id))
+    _pending_invalidations.add(task)
+    task.add_done_callback(_pending_invalidations.discard)
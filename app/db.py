@@ -1,25 +1,63 @@
+import asyncio
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 from os import getenv
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine, AsyncSession
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import Column, String, DateTime, ForeignKey
+from sqlalchemy import Column, String, DateTime, ForeignKey, Index, insert, text, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.future import select
 from fastapi import HTTPException
 from datetime import datetime
 from contextlib import asynccontextmanager
-from typing import List
+from typing import Any, Dict, List, Optional, Set, Tuple
 from uuid import uuid4
+from app.metrics import DB_SAVE_SECONDS
 from app.schemas import ImageTaskResponse, TaskToDatabase
 
 DATABASE_URL = getenv('DATABASE_URL')
+DB_ECHO = getenv('DB_ECHO', '0') == '1'
+DB_COPY_THRESHOLD = int(getenv('DB_COPY_THRESHOLD', 500))
 
-engine = create_async_engine(DATABASE_URL, echo=True)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, class_=AsyncSession)
+TASK_LINK_COLUMNS = ['task_id', 'img_link']
+COPY_STAGING_TABLE = 'image_tasks_copy'
+
+engine: Optional[AsyncEngine] = None
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, class_=AsyncSession)
+
+
+def configure_engine(**engine_kwargs) -> AsyncEngine:
+    global engine
+    engine = create_async_engine(DATABASE_URL, echo=DB_ECHO, **engine_kwargs)
+    SessionLocal.configure(bind=engine)
+    return engine
+
+
+def get_engine() -> AsyncEngine:
+    if engine is None:
+        return configure_engine()
+    return engine
+
+
+async def dispose_engine():
+    global engine
+    if engine is not None:
+        current, engine = engine, None
+        await current.dispose()
+
+
+async def warm_up_engine(connections: int):
+    async def ping():
+        async with get_engine().connect() as conn:
+            await conn.execute(text('SELECT 1'))
+
+    await asyncio.gather(*(ping() for _ in range(connections)))
 
 
 @asynccontextmanager
 async def get_session() -> AsyncSession:
+    get_engine()
     async with SessionLocal() as session:
         yield session
 
@@ -38,28 +76,184 @@ class User(Base):
 
 class ImageTask(Base):
     __tablename__ = 'image_tasks'
+    __table_args__ = (
+        Index('ix_image_tasks_user_id_created_at', 'user_id', 'created_at', 'id'),
+        Index('uq_image_tasks_task_id_img_link', 'task_id', 'img_link', unique=True),
+    )
     id = Column(String, primary_key=True, default=lambda: str(uuid4()))
-    task_id = Column(String)
-    img_link = Column(String)
+    task_id = Column(String, index=True)
+    img_link = Column(String, index=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     user_id = Column(String, ForeignKey('users.id'))
 
     user = relationship("User")
 
 
-async def get_user_history(user_id: str) -> List[ImageTaskResponse]:
+def encode_history_cursor(created_at: datetime, task_row_id: str) -> str:
+    return urlsafe_b64encode(f"{created_at.isoformat()}|{task_row_id}".encode()).decode()
+
+
+def decode_history_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        created_at, task_row_id = urlsafe_b64decode(cursor.encode()).decode().split('|', 1)
+        return datetime.fromisoformat(created_at), task_row_id
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+async def get_user_history(user_id: str, limit: int = 100,
+                           cursor: Optional[str] = None) -> Tuple[List[ImageTaskResponse], Optional[str]]:
+    query = (
+        select(ImageTask.id, ImageTask.task_id, ImageTask.img_link, ImageTask.created_at, ImageTask.user_id)
+        .where(ImageTask.user_id == user_id)
+        .order_by(ImageTask.created_at.desc(), ImageTask.id.desc())
+        .limit(limit + 1)
+    )
+    if cursor:
+        query = query.where(tuple_(ImageTask.created_at, ImageTask.id) < tuple_(*decode_history_cursor(cursor)))
+
     async with get_session() as db:
-        result = await db.execute(select(ImageTask).filter_by(user_id=user_id))
-        tasks = result.scalars().all()
-        if not tasks:
-            raise HTTPException(status_code=404, detail="No tasks found for this user")
-        history = [ImageTaskResponse(**task.__dict__) for task in tasks]
-        return history
+        result = await db.execute(query)
+        rows = result.all()
+    if not rows and not cursor:
+        raise HTTPException(status_code=404, detail="No tasks found for this user")
 
+    history = [ImageTaskResponse(**row._mapping) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = encode_history_cursor(history[-1].created_at, history[-1].id)
+    return history, next_cursor
 
-async def save_tasks_to_db(tasks: TaskToDatabase):
+
+async def get_task_links(task_id: str) -> List[str]:
+    async with get_session() as db:
+        result = await db.execute(select(ImageTask.img_link).filter_by(task_id=task_id))
+        return list(result.scalars().all())
+
+
+async def get_task_images(task_id: str) -> Tuple[List[str], Optional[datetime]]:
+    async with get_session() as db:
+        result = await db.execute(
+            select(ImageTask.img_link, ImageTask.created_at).filter_by(task_id=task_id).order_by(ImageTask.img_link)
+        )
+        rows = result.all()
+    return [row.img_link for row in rows], min((row.created_at for row in rows), default=None)
+
+
+async def image_link_exists(img_link: str) -> bool:
     async with get_session() as db:
-        for link in tasks.image_links:
-            new_task = ImageTask(task_id=tasks.task_id, img_link=link, user_id=tasks.user_id)
-            db.add(new_task)
+        result = await db.execute(select(ImageTask.id).filter_by(img_link=img_link).limit(1))
+        return result.scalar_one_or_none() is not None
+
+
+def task_rows(tasks: TaskToDatabase) -> List[Dict[str, Any]]:
+    created_at = datetime.utcnow()
+    return [
+        {'id': str(uuid4()), 'task_id': tasks.task_id, 'img_link': link,
+         'created_at': created_at, 'user_id': tasks.user_id}
+        for link in tasks.image_links
+    ]
+
+
+def insert_ignoring_duplicates(dialect: str):
+    dialect_insert = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}.get(dialect)
+    if dialect_insert is None:
+        return insert(ImageTask)
+    return dialect_insert(ImageTask).on_conflict_do_nothing(index_elements=TASK_LINK_COLUMNS)
+
+
+async def copy_task_rows(db: AsyncSession, rows: List[Dict[str, Any]]):
+    columns = list(rows[0])
+    column_list = ', '.join(columns)
+    await db.execute(text(f"CREATE TEMP TABLE {COPY_STAGING_TABLE} "
+                          f"(LIKE {ImageTask.__tablename__} INCLUDING DEFAULTS) ON COMMIT DROP"))
+    connection = await db.connection()
+    raw_connection = await connection.get_raw_connection()
+    await raw_connection.driver_connection.copy_records_to_table(
+        COPY_STAGING_TABLE,
+        records=[tuple(row[column] for column in columns) for row in rows],
+        columns=columns
+    )
+    await db.execute(text(f"INSERT INTO {ImageTask.__tablename__} ({column_list}) "
+                          f"SELECT {column_list} FROM {COPY_STAGING_TABLE} "
+                          f"ON CONFLICT ({', '.join(TASK_LINK_COLUMNS)}) DO NOTHING"))
+
+
+async def insert_task_rows(rows: List[Dict[str, Any]]):
+    if not rows:
+        return
+    dialect = get_engine().dialect
+    async with get_session() as db:
+        if len(rows) >= DB_COPY_THRESHOLD and dialect.driver == 'asyncpg':
+            await copy_task_rows(db, rows)
+        else:
+            await db.execute(insert_ignoring_duplicates(dialect.name), rows)
         await db.commit()
+
+
+class TaskWriteBuffer:
+    def __init__(self, max_rows: int, max_delay: float):
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self._rows: List[Dict[str, Any]] = []
+        self._waiters: List[asyncio.Future] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flushes: Set[asyncio.Task] = set()
+
+    def _schedule_flush(self):
+        task = asyncio.get_running_loop().create_task(self.flush())
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def add(self, tasks: TaskToDatabase):
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        self._rows.extend(task_rows(tasks))
+        self._waiters.append(waiter)
+        if len(self._rows) >= self.max_rows:
+            self._schedule_flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._schedule_flush)
+        await waiter
+
+    async def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        rows, waiters = self._rows, self._waiters
+        self._rows, self._waiters = [], []
+        if not waiters:
+            return
+
+        try:
+            await insert_task_rows(rows)
+        except Exception as e:
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_exception(e)
+        else:
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+
+
+_write_buffer: Optional[TaskWriteBuffer] = None
+
+
+def configure_write_buffer(max_rows: int, max_delay: float) -> Optional[TaskWriteBuffer]:
+    global _write_buffer
+    _write_buffer = TaskWriteBuffer(max_rows, max_delay) if max_rows > 0 else None
+    return _write_buffer
+
+
+async def flush_write_buffer():
+    if _write_buffer is not None:
+        await _write_buffer.flush()
+
+
+async def save_tasks_to_db(tasks: TaskToDatabase):
+    with DB_SAVE_SECONDS.time():
+        if _write_buffer is not None:
+            await _write_buffer.add(tasks)
+        else:
+            await insert_task_rows(task_rows(tasks))
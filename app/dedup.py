@@ -0,0 +1,87 @@
+import hashlib
+import logging
+from os import getenv
+from typing import BinaryIO, Dict, Optional
+import redis
+from app.schemas import TransformSpec
+
+logger = logging.getLogger(__name__)
+
+DEDUP_ENABLED = getenv('DEDUP_ENABLED', '1') == '1'
+DEDUP_REDIS_URL = getenv('DEDUP_REDIS_URL', getenv('CELERY_RESULT_BACKEND'))
+DEDUP_TTL_SECONDS = int(getenv('DEDUP_TTL_SECONDS', 7 * 24 * 3600))
+
+KEY_PREFIX = 'dedup:variant:'
+HITS_KEY = 'dedup:hits'
+MISSES_KEY = 'dedup:misses'
+
+_client: Optional[redis.Redis] = None
+
+
+def get_client() -> redis.Redis:
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(DEDUP_REDIS_URL)
+    return _client
+
+
+def content_hash_stream(fileobj: BinaryIO, chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: fileobj.read(chunk_size), b''):
+        digest.update(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+
+def variant_key(digest: str, spec: TransformSpec, preset: str) -> str:
+    spec_digest = hashlib.sha256(f"{preset}:{spec.model_dump_json()}".encode()).hexdigest()
+    return f"{KEY_PREFIX}{digest}:{spec_digest}"
+
+
+def lookup_variants(digest: str, variants: Dict[str, TransformSpec], preset: str,
+                    count: bool = True) -> Dict[str, str]:
+    if not DEDUP_ENABLED or not variants:
+        return {}
+    keys = [variant_key(digest, spec, preset) for spec in variants.values()]
+    try:
+        client = get_client()
+        values = client.mget(keys)
+        found = {
+            variant: value.decode()
+            for variant, value in zip(variants, values) if value is not None
+        }
+        with client.pipeline(transaction=False) as pipe:
+            for key, value in zip(keys, values):
+                if value is not None:
+                    pipe.expire(key, DEDUP_TTL_SECONDS)
+            if count:
+                pipe.incrby(HITS_KEY, len(found))
+                pipe.incrby(MISSES_KEY, len(keys) - len(found))
+            pipe.execute()
+        return found
+    except redis.RedisError:
+        logger.warning("Dedup index lookup failed", exc_info=True)
+        return {}
+
+
+def record_variants(digest: str, variants: Dict[str, TransformSpec], preset: str, image_links: Dict[str, str]):
+    if not DEDUP_ENABLED or not image_links:
+        return
+    try:
+        with get_client().pipeline(transaction=False) as pipe:
+            for variant, img_link in image_links.items():
+                pipe.set(variant_key(digest, variants[variant], preset), img_link, ex=DEDUP_TTL_SECONDS)
+            pipe.execute()
+    except redis.RedisError:
+        logger.warning("Dedup index update failed", exc_info=True)
+
+
+def get_stats() -> Dict[str, int]:
+    if not DEDUP_ENABLED:
+        return {'hits': 0, 'misses': 0}
+    try:
+        hits, misses = get_client().mget([HITS_KEY, MISSES_KEY])
+    except redis.RedisError:
+        logger.warning("Dedup stats lookup failed", exc_info=True)
+        return {'hits': 0, 'misses': 0}
+    return {'hits': int(hits or 0), 'misses': int(misses or 0)}
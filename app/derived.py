@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from os import getenv
+from typing import Any, Dict, Optional, Tuple
+import redis.asyncio as redis
+from app.storage import get_storage
+from app.transforms import VARIANTS, format_extension, output_format
+
+logger = logging.getLogger(__name__)
+
+DERIVED_PREFIX = 'derived/'
+DERIVED_MEMORY_BYTES = int(getenv('DERIVED_MEMORY_BYTES', 64 * 1024 * 1024))
+DERIVED_STORAGE_BYTES = int(getenv('DERIVED_STORAGE_BYTES', 10 * 1024 * 1024 * 1024))
+DERIVED_REDIS_URL = getenv('DERIVED_REDIS_URL', getenv('CELERY_RESULT_BACKEND'))
+DERIVED_RENDER_MEMORY_BYTES = int(getenv('DERIVED_RENDER_MEMORY_BYTES', 512 * 1024 * 1024))
+
+LRU_KEY = 'derived:lru'
+SIZES_KEY = 'derived:sizes'
+TOTAL_KEY = 'derived:total'
+
+RECORD_SIZE_SCRIPT = """
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+if redis.call('HSETNX', KEYS[2], ARGV[1], ARGV[3]) == 1 then
+    return redis.call('INCRBY', KEYS[3], ARGV[3])
+end
+return tonumber(redis.call('GET', KEYS[3]) or 0)
+"""
+
+
+class ByteLRU:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: bytes):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._items.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self._items[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.size -= len(evicted)
+
+
+_memory = ByteLRU(DERIVED_MEMORY_BYTES)
+_inflight: Dict[str, asyncio.Future] = {}
+_redis: Optional[redis.Redis] = None
+_record_size = None
+_render_budget = None
+
+
+def get_redis() -> Optional[redis.Redis]:
+    global _redis, _record_size
+    if DERIVED_REDIS_URL and _redis is None:
+        _redis = redis.Redis.from_url(DERIVED_REDIS_URL)
+        _record_size = _redis.register_script(RECORD_SIZE_SCRIPT)
+    return _redis
+
+
+def derived_key(img_link: str, variant: str) -> str:
+    stem, _, extension = img_link.rpartition('.')
+    spec = VARIANTS[variant]
+    if spec.format:
+        extension = format_extension(spec.format.upper())
+    return f"{DERIVED_PREFIX}{stem}_{variant}.{extension}"
+
+
+def get_render_budget() -> Any:
+    global _render_budget
+    if _render_budget is None:
+        from app.tiling import MemoryBudget
+        _render_budget = MemoryBudget(DERIVED_RENDER_MEMORY_BYTES)
+    return _render_budget
+
+
+def open_source(file_bytes: bytes, variant: str) -> Tuple[Any, str, int]:
+    from PIL import Image, UnidentifiedImageError
+    from app.image_processing import decode_image
+    from app.tiling import estimate_memory
+
+    spec = VARIANTS[variant]
+    try:
+        image = decode_image(file_bytes, load=False)
+    except (Image.DecompressionBombError, UnidentifiedImageError) as e:
+        raise ValueError(str(e))
+    image_format = output_format(spec, image.format or 'JPEG')
+    return image, image_format, estimate_memory(image, [(spec, image_format, {})]) + len(file_bytes)
+
+
+def render(image: Any, variant: str, image_format: str) -> bytes:
+    from PIL import Image
+    from app.image_processing import prepare_image, render_variant
+
+    spec = VARIANTS[variant]
+    try:
+        source_size = prepare_image(image, [spec])
+        image_bytes, _ = render_variant(image, spec, image_format, source_size)
+    except Image.DecompressionBombError as e:
+        raise ValueError(str(e))
+    return image_bytes.getvalue()
+
+
+async def touch(key: str, size: Optional[int] = None):
+    client = get_redis()
+    if client is None:
+        return
+    try:
+        if size is None:
+            await client.zadd(LRU_KEY, {key: time.time()})
+            return
+        total = await _record_size(keys=[LRU_KEY, SIZES_KEY, TOTAL_KEY], args=[key, time.time(), size])
+        if total > DERIVED_STORAGE_BYTES:
+            await evict(total)
+    except redis.RedisError:
+        logger.warning("Derived cache accounting failed", exc_info=True)
+
+
+async def evict(total: int):
+    client = get_redis()
+    while total > DERIVED_STORAGE_BYTES:
+        oldest = await client.zpopmin(LRU_KEY)
+        if not oldest:
+            break
+        key = oldest[0][0].decode()
+        size = int(await client.hget(SIZES_KEY, key) or 0)
+        if await client.hdel(SIZES_KEY, key):
+            total = await client.decrby(TOTAL_KEY, size)
+        await get_storage().delete(key)
+
+
+async def load_or_render(img_link: str, variant: str, key: str) -> bytes:
+    storage = get_storage()
+    data = await storage.get_if_exists(key)
+    if data is not None:
+        await touch(key)
+    else:
+        source = await storage.get(img_link)
+        image, image_format, memory = await asyncio.to_thread(open_source, source, variant)
+        async with get_render_budget().reserve(memory):
+            data = await asyncio.to_thread(render, image, variant, image_format)
+        await storage.put(key, data)
+        await touch(key, len(data))
+    _memory.put(key, data)
+    return data
+
+
+async def get_variant(img_link: str, variant: str) -> Tuple[str, bytes]:
+    key = derived_key(img_link, variant)
+    data = _memory.get(key)
+    if data is not None:
+        return key, data
+
+    future = _inflight.get(key)
+    if future is None:
+        future = asyncio.ensure_future(load_or_render(img_link, variant, key))
+        _inflight[key] = future
+        future.add_done_callback(lambda _: _inflight.pop(key, None))
+    return key, await asyncio.shield(future)
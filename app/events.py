@@ -0,0 +1,98 @@
+import asyncio
+import json
+import logging
+from contextlib import asynccontextmanager
+from os import getenv
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+import redis
+import redis.asyncio as aioredis
+from celery import states
+from celery.signals import task_failure, task_prerun, task_success
+
+logger = logging.getLogger(__name__)
+
+EVENTS_REDIS_URL = getenv('EVENTS_REDIS_URL', getenv('CELERY_RESULT_BACKEND'))
+EVENTS_KEEPALIVE_SECONDS = float(getenv('EVENTS_KEEPALIVE_SECONDS', 15))
+
+CHANNEL_PREFIX = 'task-events:'
+TERMINAL_STATES = frozenset(states.READY_STATES)
+
+_publisher: Optional[redis.Redis] = None
+_subscriber: Optional[aioredis.Redis] = None
+
+
+def channel(task_id: str) -> str:
+    return f"{CHANNEL_PREFIX}{task_id}"
+
+
+def get_publisher() -> Optional[redis.Redis]:
+    global _publisher
+    if EVENTS_REDIS_URL and _publisher is None:
+        _publisher = redis.Redis.from_url(EVENTS_REDIS_URL)
+    return _publisher
+
+
+def get_subscriber() -> Optional[aioredis.Redis]:
+    global _subscriber
+    if EVENTS_REDIS_URL and _subscriber is None:
+        _subscriber = aioredis.Redis.from_url(EVENTS_REDIS_URL)
+    return _subscriber
+
+
+def publish(task_id: str, task_status: str, info: Optional[Dict[str, Any]] = None):
+    client = get_publisher()
+    if client is None:
+        return
+    try:
+        client.publish(channel(task_id), json.dumps({**(info or {}), 'task_id': task_id, 'task_status': task_status}))
+    except redis.RedisError:
+        logger.warning("Publishing event for task %s failed", task_id, exc_info=True)
+
+
+def format_sse(payload: Dict[str, Any], event: str = 'status') -> str:
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+
+async def wait_keepalive() -> None:
+    await asyncio.sleep(EVENTS_KEEPALIVE_SECONDS)
+
+
+@asynccontextmanager
+async def subscribe(task_ids: List[str]) -> AsyncIterator[Callable[[], Awaitable[Optional[Dict[str, Any]]]]]:
+    client = get_subscriber()
+    if client is None:
+        yield wait_keepalive
+        return
+
+    pubsub = client.pubsub(ignore_subscribe_messages=True)
+    try:
+        await pubsub.subscribe(*(channel(task_id) for task_id in task_ids))
+    except aioredis.RedisError:
+        logger.warning("Subscribing to task events failed, falling back to polling", exc_info=True)
+        await pubsub.aclose()
+        yield wait_keepalive
+        return
+
+    async def next_event() -> Optional[Dict[str, Any]]:
+        message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=EVENTS_KEEPALIVE_SECONDS)
+        return json.loads(message['data']) if message else None
+
+    try:
+        yield next_event
+    finally:
+        await pubsub.aclose()
+
+
+@task_prerun.connect
+def publish_task_started(task_id: str = None, **kwargs):
+    publish(task_id, states.STARTED)
+
+
+@task_success.connect
+def publish_task_success(sender=None, result=None, **kwargs):
+    publish(sender.request.id, states.SUCCESS, result if isinstance(result, dict) else None)
+
+
+@task_failure.connect
+def publish_task_failure(task_id: str = None, **kwargs):
+    publish(task_id, states.FAILURE)
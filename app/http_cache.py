@@ -0,0 +1,126 @@
+import re
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from hashlib import blake2b
+from os import getenv
+from typing import AsyncIterator, Callable, Dict, Mapping, Optional, Tuple
+from fastapi import HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from app.storage import ObjectInfo
+
+IMAGE_CACHE_CONTROL = getenv('IMAGE_CACHE_CONTROL', 'private, max-age=31536000, immutable')
+ARCHIVE_CACHE_CONTROL = getenv('ARCHIVE_CACHE_CONTROL', 'private, no-cache')
+
+RANGE_PATTERN = re.compile(r'bytes=(\d*)-(\d*)')
+
+Body = Callable[[int, Optional[int]], AsyncIterator[bytes]]
+
+
+def content_etag(data: bytes) -> str:
+    return f'"{blake2b(data, digest_size=16).hexdigest()}"'
+
+
+def bytes_body(data: bytes) -> Body:
+    async def body(start: int, end: Optional[int]) -> AsyncIterator[bytes]:
+        yield data[start:None if end is None else end + 1]
+
+    return body
+
+
+def http_date(value: datetime) -> str:
+    return format_datetime(value.astimezone(timezone.utc).replace(microsecond=0), usegmt=True)
+
+
+def parse_http_date(value: str) -> Optional[datetime]:
+    try:
+        parsed = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return parsed if parsed.tzinfo is not None else parsed.replace(tzinfo=timezone.utc)
+
+
+def cache_headers(info: ObjectInfo, cache_control: str) -> Dict[str, str]:
+    headers = {"ETag": info.etag, "Cache-Control": cache_control, "Accept-Ranges": "bytes"}
+    if info.last_modified is not None:
+        headers["Last-Modified"] = http_date(info.last_modified)
+    return headers
+
+
+def etag_matches(header: str, etag: str, weak: bool = True) -> bool:
+    if header.strip() == '*':
+        return True
+    for candidate in header.split(','):
+        candidate = candidate.strip()
+        if weak and candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def not_modified_since(header: str, info: ObjectInfo) -> bool:
+    since = parse_http_date(header)
+    if since is None or info.last_modified is None:
+        return False
+    return info.last_modified.replace(microsecond=0) <= since
+
+
+def is_not_modified(headers: Mapping[str, str], info: ObjectInfo) -> bool:
+    if "if-none-match" in headers:
+        return etag_matches(headers["if-none-match"], info.etag)
+    if "if-modified-since" in headers:
+        return not_modified_since(headers["if-modified-since"], info)
+    return False
+
+
+def if_range_matches(header: str, info: ObjectInfo) -> bool:
+    if header.startswith('"'):
+        return etag_matches(header, info.etag, weak=False)
+    since = parse_http_date(header)
+    return since is not None and info.last_modified is not None and info.last_modified.replace(microsecond=0) == since
+
+
+def range_not_satisfiable(size: int) -> HTTPException:
+    return HTTPException(status_code=416, detail="Range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    match = RANGE_PATTERN.fullmatch(header.strip())
+    if match is None or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if not first:
+        if int(last) == 0 or size == 0:
+            raise range_not_satisfiable(size)
+        return max(size - int(last), 0), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise range_not_satisfiable(size)
+    return start, min(int(last), size - 1) if last else size - 1
+
+
+def requested_range(headers: Mapping[str, str], info: ObjectInfo) -> Optional[Tuple[int, int]]:
+    if "range" not in headers:
+        return None
+    if "if-range" in headers and not if_range_matches(headers["if-range"], info):
+        return None
+    return parse_range(headers["range"], info.size)
+
+
+def cached_response(request: Request, info: ObjectInfo, body: Body, media_type: str,
+                    cache_control: str = IMAGE_CACHE_CONTROL,
+                    headers: Optional[Dict[str, str]] = None) -> Response:
+    headers = {**(headers or {}), **cache_headers(info, cache_control)}
+    if is_not_modified(request.headers, info):
+        return Response(status_code=304, headers=headers)
+
+    byte_range = requested_range(request.headers, info)
+    if byte_range is None:
+        headers["Content-Length"] = str(info.size)
+        return StreamingResponse(body(0, None), media_type=media_type, headers=headers)
+
+    start, end = byte_range
+    headers.update({"Content-Length": str(end - start + 1), "Content-Range": f"bytes {start}-{end}/{info.size}"})
+    return StreamingResponse(body(start, end), status_code=206, media_type=media_type, headers=headers)
@@ -1,67 +1,208 @@
 import asyncio
-import zipfile
+import logging
+import multiprocessing
+from math import ceil
+from concurrent.futures import ProcessPoolExecutor
+from os import cpu_count, getenv
+from time import perf_counter
 from PIL import Image
 from io import BytesIO
-from sqlalchemy.future import select
-from app.db import ImageTask, get_session
-from app.s3_client import upload_to_s3, download_from_s3
+from typing import BinaryIO, Dict, Iterable, List, Optional, Tuple
+from app import tiling
+from app.imaging import apply_transform
+from app.ingest import MAX_IMAGE_PIXELS
+from app.metrics import IMAGE_STAGE_SECONDS
+from app.schemas import TransformSpec
+from app.storage import get_storage
+from app.transforms import (DEFAULT_ENCODER_PRESET, VARIANTS, encoder_options, format_extension,
+                            is_identity, output_format, required_scale, resolve_variants)
 
+logger = logging.getLogger(__name__)
 
-def convert_image_to_bytes(image: Image, image_format: str) -> BytesIO:
-    image_bytes = BytesIO()
-    image.save(image_bytes, format=image_format)
-    image_bytes.seek(0)
-    return image_bytes
-
-
-async def download_images_zip(task_id: str) -> BytesIO:
-    async with get_session() as db:
-        result = await db.execute(select(ImageTask).filter_by(task_id=task_id))
-        tasks = result.scalars().all()
+IMAGE_PROCESS_POOL_PIXELS = int(getenv('IMAGE_PROCESS_POOL_PIXELS', 24_000_000))
+IMAGE_PROCESS_POOL_WORKERS = int(getenv('IMAGE_PROCESS_POOL_WORKERS', cpu_count() or 1))
+DRAFT_MAX_SCALE = float(getenv('DRAFT_MAX_SCALE', 0.5))
 
-    images = [f"{task.img_link}" for task in tasks]
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
 
-    zip_buffer = BytesIO()
+_process_pool: Optional[ProcessPoolExecutor] = None
 
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        for img_name in images:
-            img_data = download_from_s3(img_name)
-            zipf.writestr(img_name, img_data)
 
-    zip_buffer.seek(0)
-
-    return zip_buffer
+def convert_image_to_bytes(image: Image, image_format: str, **options) -> BytesIO:
+    image_bytes = BytesIO()
+    image.save(image_bytes, format=image_format, **options)
+    image_bytes.seek(0)
+    return image_bytes
 
 
-async def process_and_upload_image(file_bytes: bytes, task_id: str) -> list[str]:
+def decode_image(file_bytes: bytes, load: bool = True) -> Image:
     image = Image.open(BytesIO(file_bytes))
-
-    original_image = image
-    original_format = image.format
-    if original_format is None:
-        original_format = 'JPEG'
-
-    format_extension = 'jpeg' if original_format == 'JPEG' else 'png'
-
-    rotated_image = image.transpose(Image.Transpose.ROTATE_90)
-    gray_image = image.convert('L')
-    scaled_image = image.resize((image.width // 2, image.height // 2))
-
-    original_image_bytes, rotated_image_bytes, gray_image_bytes, scaled_image_bytes = await asyncio.gather(
-        asyncio.to_thread(convert_image_to_bytes, image=original_image, image_format=original_format),
-        asyncio.to_thread(convert_image_to_bytes, image=rotated_image, image_format=original_format),
-        asyncio.to_thread(convert_image_to_bytes, image=gray_image, image_format=original_format),
-        asyncio.to_thread(convert_image_to_bytes, image=scaled_image, image_format=original_format)
-    )
-
-    await asyncio.gather(
-        asyncio.to_thread(upload_to_s3, image=original_image_bytes, file_name=f"{task_id}_original.{format_extension}"),
-        asyncio.to_thread(upload_to_s3, image=rotated_image_bytes, file_name=f"{task_id}_rotated.{format_extension}"),
-        asyncio.to_thread(upload_to_s3, image=gray_image_bytes, file_name=f"{task_id}_gray.{format_extension}"),
-        asyncio.to_thread(upload_to_s3, image=scaled_image_bytes, file_name=f"{task_id}_scaled.{format_extension}")
-    )
-
-    return [f"{task_id}_original.{format_extension}",
-            f"{task_id}_rotated.{format_extension}",
-            f"{task_id}_gray.{format_extension}",
-            f"{task_id}_scaled.{format_extension}"]
+    if image.width * image.height > MAX_IMAGE_PIXELS:
+        raise Image.DecompressionBombError(
+            f"Image size ({image.width * image.height} pixels) exceeds limit of {MAX_IMAGE_PIXELS} pixels"
+        )
+    if load:
+        image.load()
+    return image
+
+
+def prepare_image(image: Image, specs: Iterable[TransformSpec]) -> Optional[Tuple[int, int]]:
+    source_size = image.size
+    scale = max((required_scale(spec, *source_size) for spec in specs), default=1.0)
+    if image.format == 'JPEG' and scale <= DRAFT_MAX_SCALE:
+        image.draft(None, (ceil(image.width * scale), ceil(image.height * scale)))
+    image.load()
+    return source_size if image.size != source_size else None
+
+
+def render_variant(image: Image, spec: TransformSpec, image_format: str,
+                   source_size: Optional[Tuple[int, int]] = None,
+                   preset: str = DEFAULT_ENCODER_PRESET) -> Tuple[BytesIO, Dict[str, float]]:
+    started = perf_counter()
+    transformed = apply_transform(image, spec, source_size)
+    transformed_at = perf_counter()
+    image_bytes = convert_image_to_bytes(transformed, image_format, **encoder_options(spec, image_format, preset))
+    return image_bytes, {'transform': transformed_at - started, 'encode': perf_counter() - transformed_at}
+
+
+def render_variant_from_bytes(file_bytes: bytes, spec: TransformSpec, image_format: str,
+                              preset: str = DEFAULT_ENCODER_PRESET) -> Tuple[BytesIO, Dict[str, float]]:
+    started = perf_counter()
+    image = decode_image(file_bytes, load=False)
+    source_size = prepare_image(image, [spec])
+    decode_seconds = perf_counter() - started
+    image_bytes, timings = render_variant(image, spec, image_format, source_size, preset)
+    return image_bytes, {'decode': decode_seconds, **timings}
+
+
+def process_pool_available() -> bool:
+    return IMAGE_PROCESS_POOL_WORKERS > 0 and not multiprocessing.current_process().daemon
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=IMAGE_PROCESS_POOL_WORKERS,
+                                            mp_context=multiprocessing.get_context('spawn'))
+    return _process_pool
+
+
+def record_output(file_name: str, variant: str, image_format: str, preset: str, output_bytes: int,
+                  timings: Dict[str, float], stats: Optional[Dict[str, float]]):
+    for stage, seconds in timings.items():
+        IMAGE_STAGE_SECONDS.labels(stage, variant).observe(seconds)
+
+    encode_seconds = timings.get('encode', 0.0)
+    logger.info("Encoded %s (%s, preset %s): %d bytes in %.1f ms",
+                file_name, image_format, preset, output_bytes, encode_seconds * 1000)
+    if stats is not None:
+        stats['output_bytes'] = stats.get('output_bytes', 0) + output_bytes
+        stats['encode_seconds'] = stats.get('encode_seconds', 0.0) + encode_seconds
+
+
+def encode_to_stream(image: Image, image_format: str, options: Dict, timings: Dict[str, float]):
+    def produce(fileobj: BinaryIO):
+        started = perf_counter()
+        image.save(fileobj, format=image_format, **options)
+        timings['encode'] = perf_counter() - started
+    return produce
+
+
+async def upload_tiled(image: Image, file_bytes: bytes, task_id: str, specs: Dict[str, TransformSpec],
+                       source_format: str, preset: str, stats: Optional[Dict[str, float]]) -> List[str]:
+    started = perf_counter()
+    rendered_specs = {variant: spec for variant, spec in specs.items() if not is_identity(spec)}
+    source_size = None
+    if rendered_specs:
+        source_size = await asyncio.to_thread(prepare_image, image, rendered_specs.values())
+        IMAGE_STAGE_SECONDS.labels('decode', 'source').observe(perf_counter() - started)
+
+    formats = {variant: output_format(spec, source_format) for variant, spec in specs.items()}
+    file_names = {variant: f"{task_id}_{variant}.{format_extension(formats[variant])}" for variant in specs}
+    options = {variant: encoder_options(spec, formats[variant], preset) for variant, spec in rendered_specs.items()}
+
+    for variant, spec in specs.items():
+        if variant not in rendered_specs:
+            with IMAGE_STAGE_SECONDS.labels('upload', variant).time():
+                await get_storage().put(file_names[variant], file_bytes)
+            record_output(file_names[variant], variant, formats[variant], preset, len(file_bytes), {}, stats)
+
+    pending = sorted(rendered_specs, key=lambda variant: sum(
+        tiling.variant_memory(image, rendered_specs[variant], formats[variant], options[variant])
+    ))
+    for variant in pending:
+        started = perf_counter()
+        transformed = await asyncio.to_thread(tiling.render_tiled, image, rendered_specs[variant], source_size)
+        timings = {'transform': perf_counter() - started}
+        if variant == pending[-1]:
+            image.close()
+        with IMAGE_STAGE_SECONDS.labels('upload', variant).time():
+            output_bytes = await get_storage().put_stream(
+                file_names[variant], encode_to_stream(transformed, formats[variant], options[variant], timings)
+            )
+        del transformed
+        record_output(file_names[variant], variant, formats[variant], preset, output_bytes, timings, stats)
+    return list(file_names.values())
+
+
+async def upload_variants(image: Image, file_bytes: bytes, task_id: str, specs: Dict[str, TransformSpec],
+                          source_format: str, preset: str, stats: Optional[Dict[str, float]],
+                          use_process_pool: bool) -> List[str]:
+    started = perf_counter()
+    source_size = None
+    rendered_specs = [spec for spec in specs.values() if not is_identity(spec)]
+    if rendered_specs and not use_process_pool:
+        source_size = await asyncio.to_thread(prepare_image, image, rendered_specs)
+        IMAGE_STAGE_SECONDS.labels('decode', 'source').observe(perf_counter() - started)
+
+    async def render_and_upload(variant: str, spec: TransformSpec) -> str:
+        image_format = output_format(spec, source_format)
+        file_name = f"{task_id}_{variant}.{format_extension(image_format)}"
+        timings = {}
+        if is_identity(spec):
+            image_bytes = BytesIO(file_bytes)
+        elif use_process_pool:
+            loop = asyncio.get_running_loop()
+            image_bytes, timings = await loop.run_in_executor(
+                get_process_pool(), render_variant_from_bytes, file_bytes, spec, image_format, preset
+            )
+        else:
+            image_bytes, timings = await asyncio.to_thread(
+                render_variant, image, spec, image_format, source_size, preset
+            )
+        record_output(file_name, variant, image_format, preset, image_bytes.getbuffer().nbytes, timings, stats)
+        with IMAGE_STAGE_SECONDS.labels('upload', variant).time():
+            await get_storage().put(file_name, image_bytes)
+        return file_name
+
+    return list(await asyncio.gather(*(render_and_upload(variant, spec) for variant, spec in specs.items())))
+
+
+async def process_and_upload_image(file_bytes: bytes, task_id: str,
+                                   variants: Optional[List[str]] = None,
+                                   preset: str = DEFAULT_ENCODER_PRESET,
+                                   stats: Optional[Dict[str, float]] = None) -> list[str]:
+    specs = {variant: VARIANTS[variant] for variant in resolve_variants(variants)}
+
+    image = await asyncio.to_thread(decode_image, file_bytes, load=False)
+    source_format = image.format
+    if source_format is None:
+        source_format = 'JPEG'
+
+    rendered = []
+    for spec in specs.values():
+        if not is_identity(spec):
+            image_format = output_format(spec, source_format)
+            rendered.append((spec, image_format, encoder_options(spec, image_format, preset)))
+    use_process_pool = image.width * image.height >= IMAGE_PROCESS_POOL_PIXELS and process_pool_available()
+    memory = tiling.estimate_memory(image, rendered, processes=use_process_pool)
+    tiled = (image.width * image.height >= tiling.TILED_PROCESSING_PIXELS
+             or memory > tiling.memory_budget.limit)
+    if tiled:
+        memory = tiling.estimate_memory(image, rendered, tiled=True)
+
+    async with tiling.memory_budget.reserve(memory):
+        if tiled:
+            return await upload_tiled(image, file_bytes, task_id, specs, source_format, preset, stats)
+        return await upload_variants(image, file_bytes, task_id, specs, source_format, preset, stats,
+                                     use_process_pool)
@@ -0,0 +1,49 @@
+from os import getenv
+from typing import Optional, Tuple
+from PIL import Image
+from app.schemas import TransformSpec
+from app.transforms import OPTIONAL_CODECS, scaled_size
+
+IMAGE_RESAMPLE = Image.Resampling[getenv('IMAGE_RESAMPLE', 'BICUBIC').upper()]
+IMAGE_REDUCING_GAP = float(getenv('IMAGE_REDUCING_GAP', 2.0)) or None
+
+TRANSPOSES = {
+    90: Image.Transpose.ROTATE_90,
+    180: Image.Transpose.ROTATE_180,
+    270: Image.Transpose.ROTATE_270,
+}
+
+
+def convert_for_format(image: Image.Image, target_format: Optional[str]) -> Image.Image:
+    target_format = target_format.upper() if target_format else None
+    if target_format == 'JPEG' and image.mode not in ('RGB', 'L', 'CMYK'):
+        return image.convert('RGB')
+    if target_format in OPTIONAL_CODECS and image.mode not in ('RGB', 'RGBA'):
+        return image.convert('RGBA' if image.has_transparency_data else 'RGB')
+    return image
+
+
+def apply_transform(image: Image.Image, spec: TransformSpec,
+                    source_size: Optional[Tuple[int, int]] = None) -> Image.Image:
+    if spec.crop:
+        image = image.crop(spec.crop)
+
+    if spec.rotate % 360:
+        angle = spec.rotate % 360
+        if angle in TRANSPOSES:
+            image = image.transpose(TRANSPOSES[angle])
+        else:
+            image = image.rotate(angle, expand=True)
+
+    if spec.grayscale:
+        image = image.convert('L')
+
+    if spec.scale or spec.size:
+        width, height = image.size
+        if source_size is not None:
+            width, height = source_size if spec.rotate % 180 == 0 else source_size[::-1]
+        target = scaled_size(spec, width, height)
+        if target != image.size:
+            image = image.resize(target, resample=IMAGE_RESAMPLE, reducing_gap=IMAGE_REDUCING_GAP)
+
+    return convert_for_format(image, spec.format)
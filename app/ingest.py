@@ -0,0 +1,161 @@
+import struct
+from os import getenv
+from typing import BinaryIO, NamedTuple
+from fastapi import HTTPException, status
+from fastapi.responses import JSONResponse
+
+try:
+    from python_multipart.multipart import MultipartParseError, MultipartParser, parse_options_header
+except ImportError:
+    from multipart.multipart import MultipartParseError, MultipartParser, parse_options_header
+
+MAX_IMAGE_PIXELS = int(getenv('MAX_IMAGE_PIXELS', 100_000_000))
+MAX_UPLOAD_FILE_BYTES = int(getenv('MAX_UPLOAD_FILE_BYTES', 25 * 1024 * 1024))
+MAX_UPLOAD_REQUEST_BYTES = int(getenv('MAX_UPLOAD_REQUEST_BYTES', 200 * 1024 * 1024))
+MAX_UPLOAD_FILES = int(getenv('MAX_UPLOAD_FILES', 100))
+
+UPLOAD_PATHS = ('/upload',)
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+JPEG_SOI = b'\xff\xd8'
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+JPEG_STANDALONE_MARKERS = {0x01, 0xD8, *range(0xD0, 0xD8)}
+
+
+class ImageHeader(NamedTuple):
+    format: str
+    width: int
+    height: int
+
+
+def read_exact(fileobj: BinaryIO, size: int) -> bytes:
+    data = fileobj.read(size)
+    if len(data) != size:
+        raise ValueError("Truncated image header")
+    return data
+
+
+def sniff_png(fileobj: BinaryIO) -> ImageHeader:
+    length, chunk_type, width, height = struct.unpack('>I4sII', read_exact(fileobj, 16))
+    if chunk_type != b'IHDR' or length != 13:
+        raise ValueError("Malformed PNG header")
+    return ImageHeader('PNG', width, height)
+
+
+def sniff_jpeg(fileobj: BinaryIO) -> ImageHeader:
+    while True:
+        byte = read_exact(fileobj, 1)
+        if byte != b'\xff':
+            raise ValueError("Malformed JPEG header")
+        marker = read_exact(fileobj, 1)[0]
+        while marker == 0xFF:
+            marker = read_exact(fileobj, 1)[0]
+        if marker in JPEG_STANDALONE_MARKERS:
+            continue
+        if marker in (0xD9, 0xDA):
+            raise ValueError("JPEG has no frame header")
+        length = struct.unpack('>H', read_exact(fileobj, 2))[0]
+        if length < 2:
+            raise ValueError("Malformed JPEG segment")
+        if marker in JPEG_SOF_MARKERS:
+            _, height, width = struct.unpack('>BHH', read_exact(fileobj, 5))
+            return ImageHeader('JPEG', width, height)
+        fileobj.seek(length - 2, 1)
+
+
+def sniff_image(fileobj: BinaryIO) -> ImageHeader:
+    fileobj.seek(0)
+    try:
+        signature = fileobj.read(len(PNG_SIGNATURE))
+        if signature == PNG_SIGNATURE:
+            header = sniff_png(fileobj)
+        elif signature.startswith(JPEG_SOI):
+            fileobj.seek(len(JPEG_SOI))
+            header = sniff_jpeg(fileobj)
+        else:
+            raise ValueError("Unsupported image format")
+    finally:
+        fileobj.seek(0)
+
+    if not header.width or not header.height:
+        raise ValueError("Image has zero dimensions")
+    if header.width * header.height > MAX_IMAGE_PIXELS:
+        raise ValueError(f"Image size ({header.width * header.height} pixels) exceeds limit of {MAX_IMAGE_PIXELS} pixels")
+    return header
+
+
+def file_size(fileobj: BinaryIO) -> int:
+    position = fileobj.tell()
+    size = fileobj.seek(0, 2)
+    fileobj.seek(position)
+    return size
+
+
+class PartSizeLimit:
+    def __init__(self, content_type: bytes, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.exceeded = False
+        _, params = parse_options_header(content_type)
+        boundary = params.get(b'boundary')
+        self.parser = MultipartParser(boundary, {'on_part_begin': self.begin, 'on_part_data': self.data}) \
+            if boundary else None
+
+    def begin(self):
+        self.size = 0
+
+    def data(self, data: bytes, start: int, end: int):
+        self.size += end - start
+        self.exceeded = self.exceeded or self.size > self.max_bytes
+
+    def feed(self, chunk: bytes) -> bool:
+        if self.parser is not None:
+            try:
+                self.parser.write(chunk)
+            except MultipartParseError:
+                self.parser = None
+        return not self.exceeded
+
+
+class UploadLimitMiddleware:
+    def __init__(self, app, max_bytes: int = MAX_UPLOAD_REQUEST_BYTES, paths=UPLOAD_PATHS,
+                 max_file_bytes: int = MAX_UPLOAD_FILE_BYTES):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.paths = paths
+        self.max_file_bytes = max_file_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] not in self.paths or self.max_bytes <= 0:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope['headers'])
+        content_length = headers.get(b'content-length')
+        if content_length and content_length.isdigit() and int(content_length) > self.max_bytes:
+            response = JSONResponse({'detail': "Request body too large"},
+                                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+        content_type = headers.get(b'content-type', b'')
+        parts = None
+        if self.max_file_bytes > 0 and content_type.startswith(b'multipart/form-data'):
+            parts = PartSizeLimit(content_type, self.max_file_bytes)
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message['type'] == 'http.request':
+                body = message.get('body', b'')
+                received += len(body)
+                if received > self.max_bytes:
+                    raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                                        detail="Request body too large")
+                if parts is not None and not parts.feed(body):
+                    raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                                        detail="Uploaded file is too large")
+            return message
+
+        await self.app(scope, limited_receive, send)
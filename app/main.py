@@ -1,6 +1,26 @@
+from contextlib import asynccontextmanager
+from os import getenv
 from fastapi import FastAPI
+from app import db
 from app.api import router as api_router
+from app.ingest import UploadLimitMiddleware
+from app.metrics import MetricsMiddleware
+from app.storage import get_storage
 
-app = FastAPI()
+API_WARM_UP_CONNECTIONS = int(getenv('API_WARM_UP_CONNECTIONS', 0))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if API_WARM_UP_CONNECTIONS:
+        get_storage()
+        await db.warm_up_engine(API_WARM_UP_CONNECTIONS)
+    yield
+    await db.dispose_engine()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(UploadLimitMiddleware)
+app.add_middleware(MetricsMiddleware)
 
 app.include_router(api_router)
@@ -0,0 +1,105 @@
+import logging
+import os
+from os import getenv
+from time import perf_counter
+from typing import AsyncIterator
+from celery.signals import worker_init, worker_process_shutdown
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Histogram, generate_latest,
+                               multiprocess, start_http_server)
+
+logger = logging.getLogger(__name__)
+
+PROMETHEUS_MULTIPROC_DIR = getenv('PROMETHEUS_MULTIPROC_DIR')
+WORKER_METRICS_PORT = int(getenv('WORKER_METRICS_PORT', 9100))
+
+SIZE_BUCKETS = tuple(2 ** power for power in range(14, 34, 2))
+WAIT_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+IMAGE_STAGE_SECONDS = Histogram(
+    'image_stage_seconds', "Time spent in each stage of image processing", ['stage', 'variant']
+)
+DB_SAVE_SECONDS = Histogram('db_save_tasks_seconds', "Latency of saving task rows to the database")
+ZIP_BUILD_SECONDS = Histogram('zip_build_seconds', "Time to stream a task archive", buckets=WAIT_BUCKETS)
+ZIP_BYTES = Histogram('zip_bytes', "Size of streamed task archives", buckets=SIZE_BUCKETS)
+AUTH_SECONDS = Histogram('auth_seconds', "Password hashing and verification latency", ['operation'])
+QUEUE_WAIT_SECONDS = Histogram(
+    'task_queue_wait_seconds', "Time tasks spend in the broker queue", ['queue'], buckets=WAIT_BUCKETS
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    'http_request_seconds', "API request latency by route", ['method', 'route', 'status']
+)
+
+
+def get_registry() -> CollectorRegistry:
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def render_metrics() -> bytes:
+    return generate_latest(get_registry())
+
+
+async def observe_zip(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    started = perf_counter()
+    size = 0
+    async for chunk in chunks:
+        size += len(chunk)
+        yield chunk
+    ZIP_BUILD_SECONDS.observe(perf_counter() - started)
+    ZIP_BYTES.observe(size)
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        started = perf_counter()
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get('route')
+            HTTP_REQUEST_SECONDS.labels(
+                scope['method'], getattr(route, 'path', 'unmatched'), status_code
+            ).observe(perf_counter() - started)
+
+
+def is_prefork_pool(pool_cls) -> bool:
+    from celery.concurrency import get_implementation
+    from celery.concurrency.prefork import TaskPool
+
+    return issubclass(get_implementation(pool_cls), TaskPool)
+
+
+@worker_init.connect
+def start_worker_exporter(sender=None, **kwargs):
+    if WORKER_METRICS_PORT <= 0:
+        return
+    if not PROMETHEUS_MULTIPROC_DIR and is_prefork_pool(getattr(sender, 'pool_cls', 'prefork')):
+        logger.warning("Worker metrics exporter is disabled: the prefork pool records metrics in child processes, "
+                       "set PROMETHEUS_MULTIPROC_DIR to export them")
+        return
+    if PROMETHEUS_MULTIPROC_DIR:
+        os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+    start_http_server(WORKER_METRICS_PORT, registry=get_registry())
+
+
+@worker_process_shutdown.connect
+def mark_worker_process_dead(**kwargs):
+    if PROMETHEUS_MULTIPROC_DIR:
+        multiprocess.mark_process_dead(os.getpid())
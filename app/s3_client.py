@@ -1,21 +1,38 @@
 import os
-from io import BytesIO
-import boto3
+from typing import Optional
 
-s3 = boto3.client(
-    's3',
-    endpoint_url=os.getenv('MINIO_ENDPOINT_URL'),
-    aws_access_key_id=os.getenv('MINIO_ACCESS_KEY'),
-    aws_secret_access_key=os.getenv('MINIO_SECRET_KEY')
-)
+S3_MAX_POOL_CONNECTIONS = int(os.getenv('S3_MAX_POOL_CONNECTIONS', 10))
+S3_PUBLIC_ENDPOINT_URL = os.getenv('S3_PUBLIC_ENDPOINT_URL')
+S3_MULTIPART_THRESHOLD = int(os.getenv('S3_MULTIPART_THRESHOLD', 8 * 1024 * 1024))
+S3_MULTIPART_CHUNKSIZE = int(os.getenv('S3_MULTIPART_CHUNKSIZE', 8 * 1024 * 1024))
+S3_TRANSFER_CONCURRENCY = int(os.getenv('S3_TRANSFER_CONCURRENCY', 4))
 
 bucket_name = os.getenv('S3_BUCKET_NAME')
 
+_transfer_config = None
 
-def upload_to_s3(image: BytesIO, file_name: str):
-    s3.put_object(Bucket=bucket_name, Key=file_name, Body=image)
 
+def get_transfer_config():
+    global _transfer_config
+    if _transfer_config is None:
+        from boto3.s3.transfer import TransferConfig
 
-def download_from_s3(file_name: str) -> BytesIO:
-    response = s3.get_object(Bucket=bucket_name, Key=file_name)
-    return response['Body'].read()
+        _transfer_config = TransferConfig(
+            multipart_threshold=S3_MULTIPART_THRESHOLD,
+            multipart_chunksize=S3_MULTIPART_CHUNKSIZE,
+            max_concurrency=S3_TRANSFER_CONCURRENCY,
+        )
+    return _transfer_config
+
+
+def create_s3_client(max_pool_connections: int = S3_MAX_POOL_CONNECTIONS, endpoint_url: Optional[str] = None):
+    import boto3
+    from botocore.config import Config
+
+    return boto3.client(
+        's3',
+        endpoint_url=endpoint_url or os.getenv('MINIO_ENDPOINT_URL'),
+        aws_access_key_id=os.getenv('MINIO_ACCESS_KEY'),
+        aws_secret_access_key=os.getenv('MINIO_SECRET_KEY'),
+        config=Config(max_pool_connections=max_pool_connections)
+    )
@@ -0,0 +1,148 @@
+import logging
+import math
+import time
+from os import getenv
+from typing import Dict, List, Optional
+import redis
+import redis.asyncio as aioredis
+from celery.signals import before_task_publish, task_prerun
+from app.metrics import QUEUE_WAIT_SECONDS
+from app.transforms import VARIANTS, is_identity
+
+logger = logging.getLogger(__name__)
+
+SCHEDULER_REDIS_URL = getenv('SCHEDULER_REDIS_URL', getenv('CELERY_RESULT_BACKEND'))
+SMALL_QUEUE = getenv('SMALL_TASK_QUEUE', 'images.small')
+LARGE_QUEUE = getenv('LARGE_TASK_QUEUE', 'images.large')
+SMALL_TASK_MEGAPIXELS = float(getenv('SMALL_TASK_MEGAPIXELS', 16))
+SMALL_TASK_BYTES = int(getenv('SMALL_TASK_BYTES', 20 * 1024 * 1024))
+UPLOAD_RATE_MEGAPIXELS = float(getenv('UPLOAD_RATE_MEGAPIXELS', 0))
+UPLOAD_BURST_MEGAPIXELS = float(getenv('UPLOAD_BURST_MEGAPIXELS', 500))
+
+TASK_QUEUES = (SMALL_QUEUE, LARGE_QUEUE)
+BUCKET_PREFIX = 'scheduler:bucket:'
+QUEUE_WAIT_PREFIX = 'scheduler:queue-wait:'
+
+TOKEN_BUCKET_SCRIPT = """
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local now = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local burst = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens < cost then
+    wait = (cost - tokens) / rate
+else
+    tokens = tokens - cost
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+_client: Optional[redis.Redis] = None
+_async_client: Optional[aioredis.Redis] = None
+_token_bucket = None
+
+
+def get_client() -> Optional[redis.Redis]:
+    global _client
+    if SCHEDULER_REDIS_URL and _client is None:
+        _client = redis.Redis.from_url(SCHEDULER_REDIS_URL)
+    return _client
+
+
+def get_async_client() -> Optional[aioredis.Redis]:
+    global _async_client, _token_bucket
+    if SCHEDULER_REDIS_URL and _async_client is None:
+        _async_client = aioredis.Redis.from_url(SCHEDULER_REDIS_URL)
+        _token_bucket = _async_client.register_script(TOKEN_BUCKET_SCRIPT)
+    return _async_client
+
+
+def estimate_cost(pixels: List[int], variants: List[str]) -> float:
+    rendered = sum(1 for variant in variants if not is_identity(VARIANTS[variant]))
+    return sum(pixels) * max(rendered, 1) / 1_000_000
+
+
+def task_queue(megapixels: float, size: int) -> str:
+    if megapixels <= SMALL_TASK_MEGAPIXELS and size <= SMALL_TASK_BYTES:
+        return SMALL_QUEUE
+    return LARGE_QUEUE
+
+
+async def admit(user_id: str, megapixels: float) -> float:
+    if UPLOAD_RATE_MEGAPIXELS <= 0 or get_async_client() is None:
+        return 0.0
+    cost = min(megapixels, UPLOAD_BURST_MEGAPIXELS)
+    try:
+        wait = await _token_bucket(
+            keys=[f"{BUCKET_PREFIX}{user_id}"],
+            args=[time.time(), UPLOAD_RATE_MEGAPIXELS, UPLOAD_BURST_MEGAPIXELS, cost]
+        )
+    except aioredis.RedisError:
+        logger.warning("Upload admission check failed", exc_info=True)
+        return 0.0
+    return float(wait)
+
+
+def retry_after(wait: float) -> str:
+    return str(max(math.ceil(wait), 1))
+
+
+def record_queue_wait(queue: str, seconds: float):
+    client = get_client()
+    if client is None:
+        return
+    key = f"{QUEUE_WAIT_PREFIX}{queue}"
+    try:
+        with client.pipeline(transaction=False) as pipe:
+            pipe.hincrby(key, 'tasks', 1)
+            pipe.hincrbyfloat(key, 'wait_seconds', seconds)
+            pipe.hget(key, 'max_wait_seconds')
+            max_wait = pipe.execute()[-1]
+        if max_wait is None or seconds > float(max_wait):
+            client.hset(key, 'max_wait_seconds', seconds)
+    except redis.RedisError:
+        logger.warning("Recording queue wait failed", exc_info=True)
+
+
+def get_queue_stats() -> Dict[str, Dict[str, float]]:
+    client = get_client()
+    stats = {}
+    for queue in TASK_QUEUES:
+        values = {}
+        if client is not None:
+            try:
+                values = client.hgetall(f"{QUEUE_WAIT_PREFIX}{queue}")
+            except redis.RedisError:
+                logger.warning("Reading queue stats failed", exc_info=True)
+        count = int(values.get(b'tasks', 0))
+        total = float(values.get(b'wait_seconds', 0))
+        stats[queue] = {
+            'tasks': count,
+            'avg_wait_seconds': total / count if count else 0.0,
+            'max_wait_seconds': float(values.get(b'max_wait_seconds', 0)),
+        }
+    return stats
+
+
+@before_task_publish.connect
+def stamp_enqueue_time(headers: Optional[dict] = None, routing_key: Optional[str] = None, **kwargs):
+    if headers is not None:
+        headers.setdefault('enqueued_at', time.time())
+        headers.setdefault('queue_name', routing_key)
+
+
+@task_prerun.connect
+def measure_queue_wait(task=None, **kwargs):
+    enqueued_at = getattr(task.request, 'enqueued_at', None)
+    queue = getattr(task.request, 'queue_name', None) or (task.request.delivery_info or {}).get('routing_key')
+    if enqueued_at is None or queue is None:
+        return
+    wait = max(time.time() - float(enqueued_at), 0.0)
+    QUEUE_WAIT_SECONDS.labels(queue).observe(wait)
+    record_queue_wait(queue, wait)
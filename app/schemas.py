@@ -1,4 +1,4 @@
-from typing import List
+from typing import Any, Dict, List, Optional, Tuple
 from pydantic import BaseModel
 from datetime import datetime
 
@@ -8,11 +8,26 @@ class UserCreate(BaseModel):
     password: str
 
 
+class CurrentUser(BaseModel):
+    id: str
+    email: str
+
+
 class Token(BaseModel):
     access_token: str
     token_type: str
 
 
+class TransformSpec(BaseModel):
+    rotate: int = 0
+    scale: Optional[float] = None
+    size: Optional[Tuple[int, int]] = None
+    grayscale: bool = False
+    crop: Optional[Tuple[int, int, int, int]] = None
+    format: Optional[str] = None
+    encoder: Dict[str, Any] = {}
+
+
 class ImageTaskCreate(BaseModel):
     task_id: str
 
@@ -34,9 +49,34 @@ class ImageTaskResponse(BaseModel):
         from_attributes = True
 
 
+class ImageURLResponse(BaseModel):
+    img_link: str
+    url: str
+
+
 class StatusResponse(BaseModel):
     task_status: str
+    done: Optional[int] = None
+    total: Optional[int] = None
+    preset: Optional[str] = None
+    output_bytes: Optional[int] = None
+    encode_seconds: Optional[float] = None
+
+
+class BulkStatusRequest(BaseModel):
+    task_ids: List[str]
 
 
 class IDResponse(BaseModel):
     your_id: str
+
+
+class DedupStatsResponse(BaseModel):
+    hits: int
+    misses: int
+
+
+class QueueStatsResponse(BaseModel):
+    tasks: int
+    avg_wait_seconds: float
+    max_wait_seconds: float
@@ -1,19 +1,33 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from jwt import encode, decode, ExpiredSignatureError, PyJWTError
 from os import getenv
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Callable, Optional, TypeVar
 from fastapi.security import OAuth2PasswordBearer
 from fastapi import HTTPException, Depends, status
+from app import auth_cache
 from app.db import get_session, User
+from app.metrics import AUTH_SECONDS
+from app.schemas import CurrentUser
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.future import select
 import bcrypt
 
 SECRET_KEY = getenv("SECRET_KEY", "your-secret-key")
 ALGORITHM = getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
+BCRYPT_ROUNDS = int(getenv("BCRYPT_ROUNDS", 12))
+AUTH_WORKERS = int(getenv("AUTH_WORKERS", 2))
+AUTH_QUEUE_LIMIT = int(getenv("AUTH_QUEUE_LIMIT", 32))
+
+_auth_executor = ThreadPoolExecutor(max_workers=AUTH_WORKERS, thread_name_prefix='auth')
+_auth_pending = 0
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
+T = TypeVar('T')
+
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -33,40 +47,78 @@ def decode_access_token(token: str):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
 
 
+def hash_password(password: str) -> str:
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(BCRYPT_ROUNDS)).decode()
+
+
+def verify_password(password: str, hashed_password: str) -> bool:
+    return bcrypt.checkpw(password.encode(), hashed_password.encode())
+
+
+async def run_auth_job(func: Callable[..., T], *args) -> T:
+    global _auth_pending
+    if _auth_pending >= AUTH_QUEUE_LIMIT:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many authentication requests",
+            headers={"Retry-After": "1"}
+        )
+    _auth_pending += 1
+    try:
+        with AUTH_SECONDS.labels(func.__name__).time():
+            return await asyncio.get_running_loop().run_in_executor(_auth_executor, func, *args)
+    finally:
+        _auth_pending -= 1
+
+
 async def register_user(email: str, password: str):
     async with get_session() as db:
-        result = await db.execute(select(User).filter_by(email=email))
+        result = await db.execute(select(User.id).filter_by(email=email))
         existing_user = result.scalar_one_or_none()
-        if existing_user:
-            raise HTTPException(status_code=400, detail="User already exists")
+    if existing_user:
+        raise HTTPException(status_code=400, detail="User already exists")
 
-        hashed_password = bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
+    hashed_password = await run_auth_job(hash_password, password)
+    async with get_session() as db:
         new_user = User(email=email, password=hashed_password)
         db.add(new_user)
-        await db.commit()
+        try:
+            await db.commit()
+        except IntegrityError:
+            raise HTTPException(status_code=400, detail="User already exists")
         await db.refresh(new_user)
-        access_token = create_access_token(data={"email": email})
+        access_token = create_access_token(data={"email": email, "user_id": new_user.id})
         return {"access_token": access_token, "token_type": "bearer"}
 
 
 async def authenticate_user(email: str, password: str):
     async with get_session() as db:
-        result = await db.execute(select(User).filter_by(email=email))
-        user = result.scalar_one_or_none()
-        if user and bcrypt.checkpw(password.encode(), user.password.encode()):
-            access_token = create_access_token(data={"email": email})
-            return {"access_token": access_token, "token_type": "bearer"}
-        else:
-            raise HTTPException(status_code=401, detail="Invalid credentials")
+        result = await db.execute(select(User.id, User.password).filter_by(email=email))
+        user = result.one_or_none()
+    if user and await run_auth_job(verify_password, password, user.password):
+        access_token = create_access_token(data={"email": email, "user_id": user.id})
+        return {"access_token": access_token, "token_type": "bearer"}
+    else:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
 
 
-async def get_user_from_token(token: str = Depends(oauth2_scheme)) -> User:
+async def get_user_from_token(token: str = Depends(oauth2_scheme)) -> CurrentUser:
     payload = decode_access_token(token)
-    email = payload.get("email")
+    user_id = payload.get("user_id")
+    if user_id:
+        principal = await auth_cache.get_principal(user_id)
+        if principal:
+            return principal
+        query = select(User.id, User.email).filter_by(id=user_id)
+    else:
+        query = select(User.id, User.email).filter_by(email=payload.get("email"))
+
     async with get_session() as db:
-        result = await db.execute(select(User).filter_by(email=email))
-        user = result.scalar_one_or_none()
+        result = await db.execute(query)
+        user = result.one_or_none()
         if user:
-            return user
+            principal = CurrentUser(id=user.id, email=user.email)
+            await auth_cache.set_principal(principal)
+            return principal
         else:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
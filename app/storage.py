@@ -0,0 +1,340 @@
+import asyncio
+import os
+from abc import ABC, abstractmethod
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from io import BytesIO
+from os import getenv
+from typing import AsyncIterator, BinaryIO, Callable, NamedTuple, Optional, Tuple, Union
+from app.s3_client import (S3_MAX_POOL_CONNECTIONS, S3_MULTIPART_CHUNKSIZE, S3_MULTIPART_THRESHOLD,
+                           S3_PUBLIC_ENDPOINT_URL, S3_TRANSFER_CONCURRENCY, bucket_name, create_s3_client,
+                           get_transfer_config)
+
+STORAGE_BACKEND = getenv('STORAGE_BACKEND', 's3')
+LOCAL_STORAGE_PATH = getenv('LOCAL_STORAGE_PATH', '/tmp/image-storage')
+STORAGE_MAX_CONCURRENCY = int(getenv('STORAGE_MAX_CONCURRENCY', S3_MAX_POOL_CONNECTIONS))
+STORAGE_CHUNK_SIZE = int(getenv('STORAGE_CHUNK_SIZE', 256 * 1024))
+PRESIGNED_URL_EXPIRES = int(getenv('PRESIGNED_URL_EXPIRES', 3600))
+
+STAGING_PREFIX = 'staging/'
+MISSING_OBJECT_CODES = ('404', 'NoSuchKey', 'NotFound')
+
+
+class ObjectInfo(NamedTuple):
+    key: str
+    size: int
+    etag: str
+    last_modified: Optional[datetime]
+
+
+class PipeReader:
+    def __init__(self, fileobj: BinaryIO):
+        self.fileobj = fileobj
+        self.size = 0
+        self.error: Optional[BaseException] = None
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return False
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.fileobj.read(size)
+        if not data and self.error is not None:
+            raise self.error
+        self.size += len(data)
+        return data
+
+    def close(self):
+        self.fileobj.close()
+
+
+class ObjectStorage(ABC):
+    def __init__(self, max_concurrency: int = STORAGE_MAX_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._stream_semaphore: Optional[asyncio.Semaphore] = None
+        self._stream_executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    @property
+    def stream_semaphore(self) -> asyncio.Semaphore:
+        if self._stream_semaphore is None:
+            self._stream_semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._stream_semaphore
+
+    @property
+    def stream_executor(self) -> ThreadPoolExecutor:
+        if self._stream_executor is None:
+            self._stream_executor = ThreadPoolExecutor(self.max_concurrency, thread_name_prefix='put-stream')
+        return self._stream_executor
+
+    async def _call(self, func, *args, **kwargs):
+        async with self.semaphore:
+            return await asyncio.to_thread(func, *args, **kwargs)
+
+    @abstractmethod
+    async def put(self, key: str, data: Union[bytes, BinaryIO]):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def put_fileobj(self, key: str, fileobj: BinaryIO):
+        raise NotImplementedError
+
+    async def put_stream(self, key: str, produce: Callable[[BinaryIO], None]) -> int:
+        async with self.stream_semaphore:
+            read_fd, write_fd = os.pipe()
+            reader = PipeReader(os.fdopen(read_fd, 'rb'))
+
+            def write():
+                writer = os.fdopen(write_fd, 'wb')
+                try:
+                    produce(writer)
+                    writer.close()
+                except BaseException as exc:
+                    reader.error = exc
+                    raise
+                finally:
+                    try:
+                        writer.close()
+                    except OSError:
+                        pass
+
+            produced = asyncio.get_running_loop().run_in_executor(self.stream_executor, write)
+            try:
+                await self.put_fileobj(key, reader)
+            finally:
+                reader.close()
+                await asyncio.wait([produced])
+                error = produced.exception()
+            if error is not None:
+                raise error
+            return reader.size
+
+    @abstractmethod
+    async def get(self, key: str) -> bytes:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_if_exists(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_range(self, key: str, start: int, end: int) -> bytes:
+        raise NotImplementedError
+
+    @abstractmethod
+    def iter_chunks(self, key: str, start: int = 0, end: Optional[int] = None,
+                    chunk_size: int = STORAGE_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def head(self, key: str) -> Optional[ObjectInfo]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def delete(self, key: str):
+        raise NotImplementedError
+
+    def presigned_url(self, key: str, expires_in: int = PRESIGNED_URL_EXPIRES) -> Optional[str]:
+        return None
+
+
+class S3Storage(ObjectStorage):
+    def __init__(self, bucket: str = bucket_name, max_pool_connections: int = S3_MAX_POOL_CONNECTIONS,
+                 max_concurrency: int = STORAGE_MAX_CONCURRENCY):
+        super().__init__(max_concurrency)
+        self.bucket = bucket
+        self.client = create_s3_client(max_pool_connections)
+        self.presign_client = self.client
+        if S3_PUBLIC_ENDPOINT_URL:
+            self.presign_client = create_s3_client(1, endpoint_url=S3_PUBLIC_ENDPOINT_URL)
+
+    async def put(self, key: str, data: Union[bytes, BinaryIO]):
+        await self._call(self.client.put_object, Bucket=self.bucket, Key=key, Body=data)
+
+    async def put_fileobj(self, key: str, fileobj: BinaryIO):
+        await self._call(self.client.upload_fileobj, fileobj, self.bucket, key, Config=get_transfer_config())
+
+    async def get(self, key: str) -> bytes:
+        def download() -> Tuple[bytes, int]:
+            try:
+                response = self.client.get_object(Bucket=self.bucket, Key=key,
+                                                  Range=f"bytes=0-{S3_MULTIPART_THRESHOLD - 1}")
+            except self.client.exceptions.ClientError as e:
+                if e.response.get('Error', {}).get('Code') == 'InvalidRange':
+                    return b'', 0
+                raise
+            head = response['Body'].read()
+            content_range = response.get('ContentRange')
+            return head, int(content_range.rpartition('/')[2]) if content_range else len(head)
+
+        head, size = await self._call(download)
+        if size <= len(head):
+            return head
+
+        semaphore = asyncio.Semaphore(S3_TRANSFER_CONCURRENCY)
+
+        async def download_part(start: int) -> bytes:
+            async with semaphore:
+                return await self.get_range(key, start, min(start + S3_MULTIPART_CHUNKSIZE, size) - 1)
+
+        parts = await asyncio.gather(*(download_part(start)
+                                       for start in range(len(head), size, S3_MULTIPART_CHUNKSIZE)))
+        return b''.join([head, *parts])
+
+    async def get_if_exists(self, key: str) -> Optional[bytes]:
+        try:
+            return await self.get(key)
+        except self.client.exceptions.ClientError as e:
+            if e.response.get('Error', {}).get('Code') in MISSING_OBJECT_CODES:
+                return None
+            raise
+
+    async def get_range(self, key: str, start: int, end: int) -> bytes:
+        def download() -> bytes:
+            response = self.client.get_object(Bucket=self.bucket, Key=key, Range=f"bytes={start}-{end}")
+            return response['Body'].read()
+
+        return await self._call(download)
+
+    async def iter_chunks(self, key: str, start: int = 0, end: Optional[int] = None,
+                          chunk_size: int = STORAGE_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        byte_range = f"bytes={start}-{'' if end is None else end}"
+        response = await self._call(self.client.get_object, Bucket=self.bucket, Key=key, Range=byte_range)
+        body = response['Body']
+        try:
+            while True:
+                chunk = await asyncio.to_thread(body.read, chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            body.close()
+
+    async def head(self, key: str) -> Optional[ObjectInfo]:
+        try:
+            response = await self._call(self.client.head_object, Bucket=self.bucket, Key=key)
+        except self.client.exceptions.ClientError as e:
+            if e.response.get('Error', {}).get('Code') in MISSING_OBJECT_CODES:
+                return None
+            raise
+        return ObjectInfo(key, response['ContentLength'], response['ETag'], response['LastModified'])
+
+    async def delete(self, key: str):
+        await self._call(self.client.delete_object, Bucket=self.bucket, Key=key)
+
+    def presigned_url(self, key: str, expires_in: int = PRESIGNED_URL_EXPIRES) -> Optional[str]:
+        return self.presign_client.generate_presigned_url(
+            'get_object', Params={'Bucket': self.bucket, 'Key': key}, ExpiresIn=expires_in
+        )
+
+
+class LocalStorage(ObjectStorage):
+    def __init__(self, root: str = LOCAL_STORAGE_PATH, max_concurrency: int = STORAGE_MAX_CONCURRENCY):
+        super().__init__(max_concurrency)
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        path = os.path.abspath(os.path.join(self.root, key))
+        if not path.startswith(self.root + os.sep):
+            raise ValueError(f"Invalid object key: {key}")
+        return path
+
+    def _write(self, key: str, fileobj: BinaryIO):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp-{os.getpid()}-{id(fileobj)}"
+        try:
+            with open(tmp_path, 'wb') as f:
+                shutil.copyfileobj(fileobj, f, STORAGE_CHUNK_SIZE)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _read(self, key: str, start: int = 0, end: Optional[int] = None) -> bytes:
+        with open(self._path(key), 'rb') as f:
+            f.seek(start)
+            return f.read() if end is None else f.read(end - start + 1)
+
+    async def put(self, key: str, data: Union[bytes, BinaryIO]):
+        await self._call(self._write, key, BytesIO(data) if isinstance(data, bytes) else data)
+
+    async def put_fileobj(self, key: str, fileobj: BinaryIO):
+        await self._call(self._write, key, fileobj)
+
+    async def get(self, key: str) -> bytes:
+        return await self._call(self._read, key)
+
+    async def get_if_exists(self, key: str) -> Optional[bytes]:
+        try:
+            return await self.get(key)
+        except FileNotFoundError:
+            return None
+
+    async def get_range(self, key: str, start: int, end: int) -> bytes:
+        return await self._call(self._read, key, start, end)
+
+    async def iter_chunks(self, key: str, start: int = 0, end: Optional[int] = None,
+                          chunk_size: int = STORAGE_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        f = await asyncio.to_thread(open, self._path(key), 'rb')
+        try:
+            await asyncio.to_thread(f.seek, start)
+            remaining = None if end is None else end - start + 1
+            while remaining is None or remaining > 0:
+                size = chunk_size if remaining is None else min(chunk_size, remaining)
+                chunk = await asyncio.to_thread(f.read, size)
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+        finally:
+            f.close()
+
+    async def head(self, key: str) -> Optional[ObjectInfo]:
+        try:
+            stat = await asyncio.to_thread(os.stat, self._path(key))
+        except FileNotFoundError:
+            return None
+        etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+        return ObjectInfo(key, stat.st_size, etag, datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc))
+
+    async def delete(self, key: str):
+        try:
+            await asyncio.to_thread(os.remove, self._path(key))
+        except FileNotFoundError:
+            pass
+
+
+_storage: Optional[ObjectStorage] = None
+
+
+def create_storage(**kwargs) -> ObjectStorage:
+    if STORAGE_BACKEND == 'local':
+        kwargs.pop('max_pool_connections', None)
+        return LocalStorage(**kwargs)
+    return S3Storage(**kwargs)
+
+
+def configure_storage(storage: ObjectStorage) -> ObjectStorage:
+    global _storage
+    _storage = storage
+    return _storage
+
+
+def get_storage() -> ObjectStorage:
+    global _storage
+    if _storage is None:
+        _storage = create_storage()
+    return _storage
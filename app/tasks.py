@@ -1,25 +1,116 @@
 import os
 import asyncio
-from celery import Celery
-from celery.result import AsyncResult
-from app.db import save_tasks_to_db
-from app.image_processing import process_and_upload_image
-from app.schemas import TaskToDatabase
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from celery import Celery, states
+from kombu import Queue
+from app import archives, dedup, events, scheduling, worker
+from app.db import get_task_links, save_tasks_to_db
+from app.storage import get_storage
+from app.schemas import TaskToDatabase, TransformSpec
+from app.transforms import DEFAULT_ENCODER_PRESET, VARIANTS, resolve_variants
 
 celery_app = Celery('tasks', broker=os.getenv('CELERY_BROKER_URL'), backend=os.getenv('CELERY_RESULT_BACKEND'))
+celery_app.conf.update(
+    task_queues=[Queue(queue) for queue in scheduling.TASK_QUEUES],
+    task_default_queue=scheduling.SMALL_QUEUE,
+    task_acks_late=True,
+    worker_prefetch_multiplier=int(os.getenv('CELERY_PREFETCH_MULTIPLIER', 1)),
+)
 
 
-def get_task_status(task_id: str) -> str:
-    return str(AsyncResult(task_id, app=celery_app).status)
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', 4))
 
 
-async def process_image_async(file_bytes: bytes, task_id: str, user_id: str):
-    image_links = await process_and_upload_image(file_bytes, task_id)
-    await save_tasks_to_db(TaskToDatabase(task_id=task_id, image_links=image_links, user_id=user_id))
+def progress_from_meta(meta: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+    info = meta.get('result')
+    if not isinstance(info, dict):
+        info = {}
+    return str(meta['status']), info
 
 
-@celery_app.task
-def process_image(file_bytes: bytes, user_id: str):
-    task_id = process_image.request.id
-    loop = asyncio.get_event_loop()
-    return loop.run_until_complete(process_image_async(file_bytes, task_id, user_id))
+def get_task_progress(task_id: str) -> Tuple[str, Dict[str, Any]]:
+    return progress_from_meta(celery_app.backend.get_task_meta(task_id))
+
+
+def get_tasks_progress(task_ids: List[str]) -> Dict[str, Tuple[str, Dict[str, Any]]]:
+    backend = celery_app.backend
+    if not hasattr(backend, 'mget'):
+        return {task_id: get_task_progress(task_id) for task_id in task_ids}
+
+    values = backend.mget([backend.get_key_for_task(task_id) for task_id in task_ids])
+    return {
+        task_id: progress_from_meta(backend.decode_result(value) if value else {'status': states.PENDING})
+        for task_id, value in zip(task_ids, values)
+    }
+
+
+def mark_task_done(task_id: str, total: int):
+    result = {'done': total, 'total': total}
+    celery_app.backend.store_result(task_id, result, states.SUCCESS)
+    events.publish(task_id, states.SUCCESS, result)
+
+
+async def process_file(item: Dict[str, Any], prefix: str, specs: Dict[str, TransformSpec],
+                       preset: str = DEFAULT_ENCODER_PRESET, stats: Optional[Dict[str, float]] = None) -> List[str]:
+    if item.get('image_links'):
+        return item['image_links']
+
+    links = await asyncio.to_thread(dedup.lookup_variants, item['digest'], specs, preset, count=False)
+
+    missing = [variant for variant in specs if variant not in links]
+    if missing:
+        from app.image_processing import process_and_upload_image
+
+        file_bytes = await get_storage().get(item['staging_key'])
+        produced = dict(zip(missing, await process_and_upload_image(file_bytes, prefix, missing, preset, stats)))
+        await asyncio.to_thread(dedup.record_variants, item['digest'], specs, preset, produced)
+        links.update(produced)
+
+    return [links[variant] for variant in specs]
+
+
+async def process_images_async(items: List[Dict[str, Any]], task_id: str, user_id: str,
+                               variants: Optional[List[str]] = None,
+                               report_progress: Callable[[int, int], None] = lambda done, total: None,
+                               preset: str = DEFAULT_ENCODER_PRESET):
+    specs = {variant: VARIANTS[variant] for variant in resolve_variants(variants)}
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    total = len(items)
+    done = 0
+    stats = {'output_bytes': 0, 'encode_seconds': 0.0}
+
+    async def run(index: int, item: Dict[str, Any]) -> List[str]:
+        nonlocal done
+        prefix = task_id if total == 1 else f"{task_id}_{index}"
+        async with semaphore:
+            image_links = await process_file(item, prefix, specs, preset, stats)
+        done += 1
+        await asyncio.to_thread(report_progress, done, total)
+        return image_links
+
+    image_links = await get_task_links(task_id)
+    if image_links:
+        await asyncio.to_thread(report_progress, total, total)
+        if await archives.get_archive(task_id) is None:
+            await archives.precompute_archive(task_id)
+    else:
+        results = await asyncio.gather(*(run(index, item) for index, item in enumerate(items)))
+        image_links = [link for links in results for link in links]
+        await save_tasks_to_db(TaskToDatabase(task_id=task_id, image_links=image_links, user_id=user_id))
+        await archives.precompute_archive(task_id)
+
+    staging_keys = [item['staging_key'] for item in items if item.get('staging_key')]
+    await asyncio.gather(*(get_storage().delete(key) for key in staging_keys))
+    return {'done': total, 'total': total, 'preset': preset, **stats}
+
+
+@celery_app.task(bind=True)
+def process_images(self, items: List[Dict[str, Any]], user_id: str, variants: Optional[List[str]] = None,
+                   preset: str = DEFAULT_ENCODER_PRESET):
+    task_id = self.request.id
+
+    def report_progress(done: int, total: int):
+        self.update_state(task_id=task_id, state='PROGRESS', meta={'done': done, 'total': total})
+        events.publish(task_id, 'PROGRESS', {'done': done, 'total': total})
+
+    return worker.run(process_images_async(items, task_id, user_id, variants, report_progress, preset))
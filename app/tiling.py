@@ -0,0 +1,175 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from math import ceil, cos, floor, radians, sin
+from os import getenv
+from typing import Any, AsyncIterator, Dict, Iterable, Optional, Tuple
+from PIL import Image
+from app.schemas import TransformSpec
+from app.imaging import IMAGE_REDUCING_GAP, IMAGE_RESAMPLE, TRANSPOSES, apply_transform, convert_for_format
+from app.transforms import OPTIONAL_CODECS, scaled_size
+
+logger = logging.getLogger(__name__)
+
+TILED_PROCESSING_PIXELS = int(getenv('TILED_PROCESSING_PIXELS', 40_000_000))
+TILED_STRIP_BYTES = int(getenv('TILED_STRIP_BYTES', 16 * 1024 * 1024))
+IMAGE_MEMORY_BUDGET = int(getenv('IMAGE_MEMORY_BUDGET', 2 * 1024 * 1024 * 1024))
+
+RESAMPLE_SUPPORT = {
+    Image.Resampling.NEAREST: 0.5,
+    Image.Resampling.BOX: 0.5,
+    Image.Resampling.BILINEAR: 1.0,
+    Image.Resampling.HAMMING: 1.0,
+    Image.Resampling.BICUBIC: 2.0,
+    Image.Resampling.LANCZOS: 3.0,
+}
+
+
+# IMAGE_MEMORY_BUDGET applies per process: a prefork worker with concurrency N may use N x the budget.
+class MemoryBudget:
+    def __init__(self, limit: int = IMAGE_MEMORY_BUDGET):
+        self.limit = limit
+        self.used = 0
+        self._condition: Optional[asyncio.Condition] = None
+
+    @property
+    def condition(self) -> asyncio.Condition:
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    @asynccontextmanager
+    async def reserve(self, size: int) -> AsyncIterator[int]:
+        if size > self.limit:
+            logger.warning("Image needs %d bytes, more than the %d byte budget; processing it alone",
+                           size, self.limit)
+        size = min(size, self.limit)
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.used + size <= self.limit)
+            self.used += size
+        try:
+            yield size
+        finally:
+            async with self.condition:
+                self.used -= size
+                self.condition.notify_all()
+
+
+memory_budget = MemoryBudget()
+
+
+def pixel_bytes(mode: str) -> int:
+    return {'1': 1, 'L': 1, 'P': 1, 'I;16': 2}.get(mode, 4)
+
+
+def output_size(spec: TransformSpec, width: int, height: int) -> Tuple[int, int]:
+    if spec.crop:
+        width, height = spec.crop[2] - spec.crop[0], spec.crop[3] - spec.crop[1]
+    angle = spec.rotate % 360
+    if angle % 180 == 90:
+        width, height = height, width
+    elif angle % 90:
+        width, height = (ceil(abs(width * cos(radians(angle))) + abs(height * sin(radians(angle)))),
+                         ceil(abs(width * sin(radians(angle))) + abs(height * cos(radians(angle)))))
+    if spec.scale or spec.size:
+        return scaled_size(spec, width, height)
+    return width, height
+
+
+def encoder_bytes(image_format: str, mode: str, pixels: int, options: Dict[str, Any]) -> int:
+    if image_format == 'JPEG' and (options.get('optimize') or options.get('progressive')):
+        coefficients = 2 if mode == 'L' else 6 if options.get('subsampling') == 0 else 3
+        return pixels * (coefficients + 1)
+    if image_format in OPTIONAL_CODECS:
+        return pixels * 4
+    return 0
+
+
+def variant_memory(image: Image.Image, spec: TransformSpec, image_format: str,
+                   options: Dict[str, Any]) -> Tuple[int, int]:
+    width, height = output_size(spec, image.width, image.height)
+    mode = 'L' if spec.grayscale else image.mode if not spec.format else 'RGBA'
+    return width * height * pixel_bytes(mode), encoder_bytes(image_format, mode, width * height, options)
+
+
+def estimate_memory(image: Image.Image, variants: Iterable[Tuple[TransformSpec, str, Dict[str, Any]]],
+                    tiled: bool = False, processes: bool = False) -> int:
+    source = image.width * image.height * pixel_bytes(image.mode)
+    outputs = sorted((variant_memory(image, spec, image_format, options)
+                      for spec, image_format, options in variants), key=sum)
+    if tiled:
+        if not outputs:
+            return source
+        *earlier, (bitmap, encoder) = outputs
+        peaks = [source + sum(output) for output in earlier] + [source + bitmap, bitmap + encoder]
+        return max(peaks) + 2 * TILED_STRIP_BYTES
+    if processes:
+        return sum(source + sum(output) for output in outputs)
+    return source + sum(sum(output) for output in outputs)
+
+
+def strip_rows(width: int, source_width: int, scale: float) -> int:
+    return max(int(TILED_STRIP_BYTES // (max(width, source_width * scale, 1) * 4)), 1)
+
+
+def resize_margin(scale: float) -> int:
+    return ceil(RESAMPLE_SUPPORT.get(IMAGE_RESAMPLE, 3.0) * max(scale, 1.0)) + 1
+
+
+def new_canvas(strip: Image.Image, size: Tuple[int, int]) -> Image.Image:
+    canvas = Image.new(strip.mode, size)
+    if strip.mode in ('P', 'PA'):
+        canvas.putpalette(strip.getpalette(strip.palette.mode), strip.palette.mode)
+    canvas.info.update(strip.info)
+    return canvas
+
+
+def strip_position(angle: int, top: int, bottom: int, height: int) -> Tuple[int, int]:
+    return {0: (0, top), 90: (top, 0), 180: (0, height - bottom), 270: (height - bottom, 0)}[angle]
+
+
+def render_tiled(image: Image.Image, spec: TransformSpec,
+                 source_size: Optional[Tuple[int, int]] = None) -> Image.Image:
+    if spec.rotate % 90:
+        return apply_transform(image, spec, source_size)
+
+    left, top, right, bottom = spec.crop or (0, 0, image.width, image.height)
+    width, height = right - left, bottom - top
+    angle = spec.rotate % 360
+    target = (width, height)
+    if spec.scale or spec.size:
+        base_width, base_height = source_size or (width, height)
+        if angle % 180:
+            target = scaled_size(spec, base_height, base_width)[::-1]
+        else:
+            target = scaled_size(spec, base_width, base_height)
+    resize = target != (width, height)
+    scale_y = height / target[1]
+    margin = resize_margin(scale_y)
+
+    canvas = None
+    rows = strip_rows(target[0], width, scale_y if resize else 1.0)
+    for strip_top in range(0, target[1], rows):
+        strip_bottom = min(strip_top + rows, target[1])
+        if resize:
+            box_top, box_bottom = top + strip_top * scale_y, top + strip_bottom * scale_y
+            region_top = max(floor(box_top) - margin, top)
+            region_bottom = min(ceil(box_bottom) + margin, bottom)
+            strip = image.crop((left, region_top, right, region_bottom))
+            if spec.grayscale:
+                strip = strip.convert('L')
+            strip = strip.resize((target[0], strip_bottom - strip_top), resample=IMAGE_RESAMPLE,
+                                 box=(0, box_top - region_top, width, box_bottom - region_top),
+                                 reducing_gap=IMAGE_REDUCING_GAP)
+        else:
+            strip = image.crop((left, top + strip_top, right, top + strip_bottom))
+            if spec.grayscale:
+                strip = strip.convert('L')
+        if angle:
+            strip = strip.transpose(TRANSPOSES[angle])
+        strip = convert_for_format(strip, spec.format)
+
+        if canvas is None:
+            canvas = new_canvas(strip, target[::-1] if angle % 180 else target)
+        canvas.paste(strip, strip_position(angle, strip_top, strip_bottom, target[1]))
+    return canvas
@@ -0,0 +1,106 @@
+from os import getenv
+from typing import Any, Dict, List, Optional, Tuple
+from app.schemas import TransformSpec
+
+DEFAULT_PRESET = ['original', 'rotated', 'gray', 'scaled']
+
+FORMAT_EXTENSIONS = {'JPEG': 'jpeg', 'PNG': 'png', 'WEBP': 'webp', 'AVIF': 'avif'}
+
+OPTIONAL_CODECS = {'WEBP': 'webp', 'AVIF': 'avif'}
+
+ENCODER_PRESETS: Dict[str, Dict[str, Dict[str, Any]]] = {
+    'speed': {
+        'JPEG': {'quality': 75},
+        'PNG': {'compress_level': 1},
+        'WEBP': {'quality': 80, 'method': 0},
+        'AVIF': {'quality': 60, 'speed': 10},
+    },
+    'balanced': {
+        'JPEG': {'quality': 75, 'optimize': True},
+        'PNG': {'compress_level': 6},
+        'WEBP': {'quality': 80, 'method': 4},
+        'AVIF': {'quality': 60, 'speed': 8},
+    },
+    'size': {
+        'JPEG': {'quality': 75, 'optimize': True, 'progressive': True},
+        'PNG': {'optimize': True},
+        'WEBP': {'quality': 75, 'method': 6},
+        'AVIF': {'quality': 50, 'speed': 6},
+    },
+}
+
+DEFAULT_ENCODER_PRESET = getenv('DEFAULT_ENCODER_PRESET', 'balanced')
+
+VARIANTS: Dict[str, TransformSpec] = {}
+
+
+def register_variant(name: str, spec: TransformSpec):
+    VARIANTS[name] = spec
+
+
+def resolve_variants(names: Optional[List[str]]) -> List[str]:
+    if not names:
+        return list(DEFAULT_PRESET)
+    resolved = []
+    for name in names:
+        for variant in name.split(','):
+            variant = variant.strip()
+            if variant not in VARIANTS:
+                raise ValueError(f"Unknown variant: {variant}")
+            if variant not in resolved:
+                resolved.append(variant)
+    return resolved
+
+
+def is_identity(spec: TransformSpec) -> bool:
+    return spec == TransformSpec()
+
+
+def codec_available(image_format: str) -> bool:
+    from PIL import features
+
+    feature = OPTIONAL_CODECS.get(image_format)
+    return feature is None or bool(features.check(feature))
+
+
+def output_format(spec: TransformSpec, source_format: str) -> str:
+    image_format = (spec.format or source_format).upper()
+    if not codec_available(image_format):
+        return source_format.upper()
+    return image_format
+
+
+def encoder_options(spec: TransformSpec, image_format: str, preset: str = DEFAULT_ENCODER_PRESET) -> Dict[str, Any]:
+    options = dict(ENCODER_PRESETS[preset].get(image_format, {}))
+    options.update(spec.encoder)
+    return options
+
+
+def format_extension(image_format: str) -> str:
+    return FORMAT_EXTENSIONS.get(image_format, image_format.lower())
+
+
+def required_scale(spec: TransformSpec, width: int, height: int) -> float:
+    if spec.crop or spec.rotate % 90 or not (spec.scale or spec.size):
+        return 1.0
+    if spec.scale:
+        return min(spec.scale, 1.0)
+    if spec.rotate % 180:
+        width, height = height, width
+    return min(spec.size[0] / width, spec.size[1] / height, 1.0)
+
+
+def scaled_size(spec: TransformSpec, width: int, height: int) -> Tuple[int, int]:
+    ratio = spec.scale or min(spec.size[0] / width, spec.size[1] / height, 1)
+    return max(int(width * ratio), 1), max(int(height * ratio), 1)
+
+
+register_variant('original', TransformSpec())
+register_variant('rotated', TransformSpec(rotate=90))
+register_variant('gray', TransformSpec(grayscale=True))
+register_variant('scaled', TransformSpec(scale=0.5))
+register_variant('thumbnail', TransformSpec(size=(256, 256)))
+register_variant('webp', TransformSpec(format='WEBP'))
+register_variant('thumbnail_webp', TransformSpec(size=(256, 256), format='WEBP'))
+register_variant('avif', TransformSpec(format='AVIF'))
+register_variant('thumbnail_avif', TransformSpec(size=(256, 256), format='AVIF'))
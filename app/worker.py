@@ -0,0 +1,92 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from os import getenv
+from importlib import import_module
+from typing import Any, Coroutine, Optional
+from celery.signals import worker_init, worker_process_init, worker_process_shutdown
+from app import db
+from app.storage import configure_storage, create_storage
+
+logger = logging.getLogger(__name__)
+
+WORKER_DB_POOL_SIZE = int(getenv('WORKER_DB_POOL_SIZE', 5))
+WORKER_DB_MAX_OVERFLOW = int(getenv('WORKER_DB_MAX_OVERFLOW', 5))
+WORKER_EXECUTOR_THREADS = int(getenv('WORKER_EXECUTOR_THREADS', 16))
+WORKER_S3_MAX_CONNECTIONS = int(getenv('WORKER_S3_MAX_CONNECTIONS', WORKER_EXECUTOR_THREADS))
+WORKER_WRITE_BUFFER_ROWS = int(getenv('WORKER_WRITE_BUFFER_ROWS', 0))
+WORKER_WRITE_BUFFER_DELAY = float(getenv('WORKER_WRITE_BUFFER_DELAY', 0.05))
+
+WORKER_PRELOAD_MODULES = ['app.image_processing']
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_thread: Optional[threading.Thread] = None
+_lock = threading.Lock()
+_warm_up: Optional[Future] = None
+
+
+def log_warm_up_failure(future: Future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.warning("Database pool warm-up failed", exc_info=future.exception())
+
+
+def start_worker_loop() -> asyncio.AbstractEventLoop:
+    global _loop, _loop_thread, _warm_up
+    with _lock:
+        if _loop is not None:
+            return _loop
+
+        db.configure_engine(pool_size=WORKER_DB_POOL_SIZE, max_overflow=WORKER_DB_MAX_OVERFLOW, pool_pre_ping=True)
+        db.configure_write_buffer(WORKER_WRITE_BUFFER_ROWS, WORKER_WRITE_BUFFER_DELAY)
+        configure_storage(create_storage(max_pool_connections=WORKER_S3_MAX_CONNECTIONS,
+                                         max_concurrency=WORKER_S3_MAX_CONNECTIONS))
+
+        loop = asyncio.new_event_loop()
+        loop.set_default_executor(ThreadPoolExecutor(WORKER_EXECUTOR_THREADS, thread_name_prefix='image-worker'))
+        _loop_thread = threading.Thread(target=loop.run_forever, name='image-worker-loop', daemon=True)
+        _loop_thread.start()
+        _loop = loop
+        _warm_up = asyncio.run_coroutine_threadsafe(db.warm_up_engine(WORKER_DB_POOL_SIZE), loop)
+        _warm_up.add_done_callback(log_warm_up_failure)
+    return loop
+
+
+def run(coro: Coroutine[Any, Any, Any]) -> Any:
+    loop = _loop or start_worker_loop()
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+
+def stop_worker_loop():
+    global _loop, _loop_thread, _warm_up
+    with _lock:
+        loop, thread, warm_up = _loop, _loop_thread, _warm_up
+        _loop, _loop_thread, _warm_up = None, None, None
+    if loop is None:
+        return
+
+    warm_up.cancel()
+
+    try:
+        asyncio.run_coroutine_threadsafe(db.flush_write_buffer(), loop).result()
+    finally:
+        asyncio.run_coroutine_threadsafe(db.dispose_engine(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+
+@worker_init.connect
+def preload_worker_modules(**kwargs):
+    for module in WORKER_PRELOAD_MODULES:
+        import_module(module)
+
+
+@worker_process_init.connect
+def init_worker_process(**kwargs):
+    start_worker_loop()
+
+
+@worker_process_shutdown.connect
+def shutdown_worker_process(**kwargs):
+    stop_worker_loop()
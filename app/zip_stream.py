@@ -0,0 +1,135 @@
+import struct
+import zlib
+from datetime import datetime
+from typing import AsyncIterable, AsyncIterator, Iterator, List, Optional, Tuple
+from zipfile import ZIP_STORED, ZIP_DEFLATED
+
+CHUNK_SIZE = 64 * 1024
+
+STORED_EXTENSIONS = {'jpg', 'jpeg', 'png', 'webp', 'avif'}
+
+_ZIP64_LIMIT = 0xFFFFFFFF
+_FLAG_DATA_DESCRIPTOR = 0x08
+_FLAG_UTF8 = 0x800
+
+
+def _dos_datetime(t: datetime) -> Tuple[int, int]:
+    dos_time = (t.hour << 11) | (t.minute << 5) | (t.second // 2)
+    dos_date = ((max(t.year, 1980) - 1980) << 9) | (t.month << 5) | t.day
+    return dos_time, dos_date
+
+
+def _is_stored(name: str) -> bool:
+    return '.' in name and name.rsplit('.', 1)[1].lower() in STORED_EXTENSIONS
+
+
+def _chunks(data: bytes) -> Iterator[bytes]:
+    view = memoryview(data)
+    for start in range(0, len(view), CHUNK_SIZE):
+        yield bytes(view[start:start + CHUNK_SIZE])
+
+
+class _Entry:
+    def __init__(self, name: bytes, method: int, flags: int, crc: int,
+                 compressed_size: int, size: int, offset: int):
+        self.name = name
+        self.method = method
+        self.flags = flags
+        self.crc = crc
+        self.compressed_size = compressed_size
+        self.size = size
+        self.offset = offset
+
+    def central_header(self, dos_time: int, dos_date: int) -> bytes:
+        extra = b''
+        offset = self.offset
+        version = 20
+        if offset >= _ZIP64_LIMIT:
+            extra = struct.pack('<HHQ', 0x0001, 8, offset)
+            offset = _ZIP64_LIMIT
+            version = 45
+        header = struct.pack(
+            '<IHHHHHHIIIHHHHHII',
+            0x02014b50, version, version, self.flags, self.method, dos_time, dos_date,
+            self.crc, self.compressed_size, self.size,
+            len(self.name), len(extra), 0, 0, 0, 0, offset
+        )
+        return header + self.name + extra
+
+
+async def stream_zip(files: AsyncIterable[Tuple[str, bytes]],
+                     modified: Optional[datetime] = None) -> AsyncIterator[bytes]:
+    dos_time, dos_date = _dos_datetime(modified or datetime.now())
+    entries: List[_Entry] = []
+    offset = 0
+
+    async for file_name, data in files:
+        name = file_name.encode('utf-8')
+        crc = zlib.crc32(data)
+
+        if _is_stored(file_name):
+            flags = _FLAG_UTF8
+            local_header = struct.pack(
+                '<IHHHHHIIIHH',
+                0x04034b50, 20, flags, ZIP_STORED, dos_time, dos_date,
+                crc, len(data), len(data), len(name), 0
+            ) + name
+            yield local_header
+            for chunk in _chunks(data):
+                yield chunk
+            entries.append(_Entry(name, ZIP_STORED, flags, crc, len(data), len(data), offset))
+            offset += len(local_header) + len(data)
+            continue
+
+        flags = _FLAG_UTF8 | _FLAG_DATA_DESCRIPTOR
+        local_header = struct.pack(
+            '<IHHHHHIIIHH',
+            0x04034b50, 20, flags, ZIP_DEFLATED, dos_time, dos_date,
+            0, 0, 0, len(name), 0
+        ) + name
+        yield local_header
+
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        compressed_size = 0
+        for chunk in _chunks(data):
+            compressed = compressor.compress(chunk)
+            if compressed:
+                compressed_size += len(compressed)
+                yield compressed
+        compressed = compressor.flush()
+        compressed_size += len(compressed)
+        yield compressed
+
+        descriptor = struct.pack('<IIII', 0x08074b50, crc, compressed_size, len(data))
+        yield descriptor
+        entries.append(_Entry(name, ZIP_DEFLATED, flags, crc, compressed_size, len(data), offset))
+        offset += len(local_header) + compressed_size + len(descriptor)
+
+    central_directory_offset = offset
+    central_directory_size = 0
+    for entry in entries:
+        header = entry.central_header(dos_time, dos_date)
+        central_directory_size += len(header)
+        yield header
+
+    count = len(entries)
+    if central_directory_offset >= _ZIP64_LIMIT or count >= 0xFFFF:
+        zip64_end_offset = central_directory_offset + central_directory_size
+        yield struct.pack(
+            '<IQHHIIQQQQ',
+            0x06064b50, 44, 45, 45, 0, 0, count, count,
+            central_directory_size, central_directory_offset
+        )
+        yield struct.pack('<IIQI', 0x07064b50, 0, zip64_end_offset, 1)
+        yield struct.pack(
+            '<IHHHHIIH',
+            0x06054b50, 0, 0, 0xFFFF, 0xFFFF,
+            _ZIP64_LIMIT, _ZIP64_LIMIT, 0
+        )
+    else:
+        yield struct.pack(
+            '<IHHHHIIH',
+            0x06054b50, 0, 0, count, count,
+            central_directory_size, central_directory_offset, 0
+        )
+
@@ -0,0 +1,72 @@
+import json
+import platform
+import statistics
+import subprocess
+import time
+from io import BytesIO
+from typing import Any, Callable, Dict, List, Optional
+from PIL import Image, features
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * pct / 100), len(ordered) - 1)]
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    return {
+        'count': len(samples),
+        'mean_ms': statistics.fmean(samples) * 1000,
+        'p50_ms': statistics.median(samples) * 1000,
+        'p99_ms': percentile(samples, 99) * 1000,
+    }
+
+
+def timeit(func: Callable[[], Any], repeat: int) -> List[float]:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def make_image(width: int, height: int, image_format: str = 'JPEG') -> bytes:
+    gradient = Image.linear_gradient('L').resize((width, height))
+    image = Image.merge('RGB', (gradient, gradient.transpose(Image.Transpose.ROTATE_90).resize((width, height)),
+                                Image.effect_noise((width, height), 64)))
+    buffer = BytesIO()
+    image.save(buffer, format=image_format, **({'quality': 90} if image_format == 'JPEG' else {}))
+    return buffer.getvalue()
+
+
+def parse_size(value: str) -> tuple:
+    width, height = value.lower().split('x')
+    return int(width), int(height)
+
+
+def git_revision() -> Optional[str]:
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip()
+
+
+def write_results(path: Optional[str], benchmark: str, params: Dict[str, Any],
+                  results: List[Dict[str, Any]]) -> str:
+    revision = git_revision()
+    path = path or f"bench-{benchmark}-{revision or 'unknown'}.json"
+    payload = {
+        'benchmark': benchmark,
+        'revision': revision,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'pillow': Image.__version__,
+        'codecs': {codec: bool(features.check(codec)) for codec in ('jpg', 'zlib', 'webp', 'avif')},
+        'params': params,
+        'results': results,
+    }
+    with open(path, 'w') as output:
+        json.dump(payload, output, indent=2)
+    return path
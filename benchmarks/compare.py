@@ -0,0 +1,49 @@
+import argparse
+import json
+import sys
+from typing import Any, Dict, Tuple
+
+METRIC_SUFFIXES = ('_ms', '_per_second', '_bytes', 'count')
+HIGHER_IS_BETTER = ('_per_second',)
+
+
+def load(path: str) -> Dict[str, Any]:
+    with open(path) as source:
+        return json.load(source)
+
+
+def result_key(result: Dict[str, Any]) -> Tuple:
+    return tuple(sorted((name, str(value)) for name, value in result.items()
+                        if not name.endswith(METRIC_SUFFIXES) and name != 'failed'))
+
+
+def main(base_path: str, head_path: str, metric: str, threshold: float) -> int:
+    base, head = load(base_path), load(head_path)
+    base_results = {result_key(result): result for result in base['results']}
+    regressions = 0
+    print(f"{base.get('revision')} -> {head.get('revision')} ({metric}, threshold {threshold:.0f}%)")
+    for result in head['results']:
+        previous = base_results.get(result_key(result))
+        name = next((candidate for candidate in (metric, 'images_per_second', 'requests_per_second',
+                                                 'megabytes_per_second') if candidate in result), None)
+        if previous is None or name is None or not previous.get(name):
+            continue
+        change = (result[name] - previous[name]) / previous[name] * 100
+        if name.endswith(HIGHER_IS_BETTER):
+            change = -change
+        regressed = change > threshold
+        regressions += regressed
+        label = ' '.join(value if field in ('stage', 'scenario') else f"{field}={value}"
+                         for field, value in result_key(result))
+        print(f"{'REGRESSION' if regressed else 'ok':>10} {change:+7.1f}% {name:<20} {label}")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument('base')
+    parser.add_argument('head')
+    parser.add_argument('--metric', default='p50_ms')
+    parser.add_argument('--threshold', type=float, default=10.0)
+    args = parser.parse_args()
+    sys.exit(main(args.base, args.head, args.metric, args.threshold))
@@ -0,0 +1,50 @@
+import argparse
+import statistics
+from io import BytesIO
+from typing import List
+from PIL import Image
+from benchmarks.common import make_image, timeit
+from app.image_processing import convert_image_to_bytes, decode_image, prepare_image
+from app.imaging import apply_transform
+from app.transforms import VARIANTS
+
+SIZES = {'2mp': (1600, 1200), '12mp': (4000, 3000), '24mp': (6000, 4000)}
+
+
+def legacy(file_bytes: bytes, variant: str) -> bytes:
+    image = Image.open(BytesIO(file_bytes))
+    image.load()
+    spec = VARIANTS[variant]
+    if spec.scale:
+        image = image.resize((int(image.width * spec.scale), int(image.height * spec.scale)))
+    else:
+        ratio = min(spec.size[0] / image.width, spec.size[1] / image.height, 1)
+        image = image.resize((int(image.width * ratio), int(image.height * ratio)))
+    return convert_image_to_bytes(image, 'JPEG').getvalue()
+
+
+def fast(file_bytes: bytes, variant: str) -> bytes:
+    spec = VARIANTS[variant]
+    image = decode_image(file_bytes, load=False)
+    source_size = prepare_image(image, [spec])
+    return convert_image_to_bytes(apply_transform(image, spec, source_size), 'JPEG').getvalue()
+
+
+def main(repeat: int, variants: List[str]):
+    for size_name, (width, height) in SIZES.items():
+        file_bytes = make_image(width, height)
+        for variant in variants:
+            results = {}
+            for name, func in (('legacy', legacy), ('fast', fast)):
+                samples = timeit(lambda: func(file_bytes, variant), repeat)
+                results[name] = statistics.median(samples) * 1000
+            print(f"{size_name:>5} {variant:<10} legacy={results['legacy']:8.1f}ms fast={results['fast']:8.1f}ms "
+                  f"speedup={results['legacy'] / results['fast']:.1f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare full decode + resize with the draft/reduce fast path")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--variants', nargs='+', default=['scaled', 'thumbnail'])
+    args = parser.parse_args()
+    main(args.repeat, args.variants)
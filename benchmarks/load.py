@@ -0,0 +1,168 @@
+import argparse
+import asyncio
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import uuid4
+import httpx
+from benchmarks.common import make_image, parse_size, summarize, write_results
+
+TERMINAL_STATES = {'SUCCESS', 'FAILURE', 'REVOKED'}
+
+
+def prefixed(prefix: str, values: Dict[str, float]) -> Dict[str, float]:
+    return {f"{prefix}_{name}": value for name, value in values.items()}
+
+
+async def register(client: httpx.AsyncClient) -> Tuple[str, str, Dict[str, str]]:
+    email, password = f"{uuid4()}bench@example.com", "password"
+    response = await client.post("/registration", json={"email": email, "password": password})
+    response.raise_for_status()
+    return email, password, {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+async def run_concurrently(count: int, concurrency: int, func) -> List[Any]:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(index: int):
+        async with semaphore:
+            return await func(index)
+
+    return await asyncio.gather(*(run(index) for index in range(count)))
+
+
+async def bench_login(client: httpx.AsyncClient, email: str, password: str,
+                      requests: int, concurrency: int) -> Dict[str, Any]:
+    async def login(_: int) -> Tuple[float, int]:
+        started = time.perf_counter()
+        response = await client.post("/login", data={"username": email, "password": password})
+        return time.perf_counter() - started, response.status_code
+
+    started = time.perf_counter()
+    results = await run_concurrently(requests, concurrency, login)
+    elapsed = time.perf_counter() - started
+    ok = [latency for latency, status in results if status == 200]
+    return {'scenario': 'login', 'concurrency': concurrency, 'requests': requests,
+            'failed': requests - len(ok), 'requests_per_second': len(ok) / elapsed,
+            **(summarize(ok) if ok else {})}
+
+
+async def wait_for_task(client: httpx.AsyncClient, headers: Dict[str, str], task_id: str,
+                        poll_interval: float) -> str:
+    while True:
+        response = await client.get(f"/status/{task_id}", headers=headers)
+        status = response.json().get("task_status")
+        if status in TERMINAL_STATES:
+            return status
+        await asyncio.sleep(poll_interval)
+
+
+async def bench_upload(client: httpx.AsyncClient, headers: Dict[str, str], image: bytes, size: str,
+                       files_per_upload: int, uploads: int, concurrency: int, poll_interval: float,
+                       warmup: int = 0) -> Tuple[Dict[str, Any], List[str]]:
+    async def upload(index: int) -> Optional[Tuple[float, float, str]]:
+        files = [("files", (f"bench_{index}_{number}.jpg", image, "image/jpeg")) for number in range(files_per_upload)]
+        started = time.perf_counter()
+        response = await client.post("/upload", files=files, headers=headers)
+        accepted = time.perf_counter() - started
+        if response.status_code != 200:
+            return None
+        task_id = response.json()["task_id"]
+        if await wait_for_task(client, headers, task_id, poll_interval) != 'SUCCESS':
+            return None
+        return accepted, time.perf_counter() - started, task_id
+
+    await run_concurrently(warmup, concurrency, upload)
+    started = time.perf_counter()
+    results = [result for result in await run_concurrently(uploads, concurrency, upload) if result]
+    elapsed = time.perf_counter() - started
+    summary = {'scenario': 'upload', 'size': size, 'files_per_upload': files_per_upload,
+               'concurrency': concurrency, 'uploads': uploads, 'failed': uploads - len(results),
+               'images_per_second': len(results) * files_per_upload / elapsed}
+    if results:
+        summary.update(prefixed('request', summarize([accepted for accepted, _, _ in results])))
+        summary.update(prefixed('completion', summarize([completed for _, completed, _ in results])))
+    return summary, [task_id for _, _, task_id in results]
+
+
+async def bench_zip(client: httpx.AsyncClient, headers: Dict[str, str], task_ids: List[str],
+                    concurrency: int) -> Dict[str, Any]:
+    async def download(index: int) -> Tuple[float, int]:
+        started = time.perf_counter()
+        size = 0
+        async with client.stream("GET", f"/task/{task_ids[index]}", headers=headers) as response:
+            async for chunk in response.aiter_bytes():
+                size += len(chunk)
+        return time.perf_counter() - started, size
+
+    started = time.perf_counter()
+    results = await run_concurrently(len(task_ids), concurrency, download)
+    elapsed = time.perf_counter() - started
+    return {'scenario': 'zip', 'concurrency': concurrency, 'downloads': len(task_ids),
+            'megabytes_per_second': sum(size for _, size in results) / elapsed / 1024 / 1024,
+            **summarize([latency for latency, _ in results])}
+
+
+async def run_scenarios(client: httpx.AsyncClient, args) -> List[Dict[str, Any]]:
+    email, password, headers = await register(client)
+    results = []
+    if 'login' in args.scenarios:
+        results.append(await bench_login(client, email, password, args.logins, args.concurrency))
+
+    task_ids: List[str] = []
+    if 'upload' in args.scenarios or 'zip' in args.scenarios:
+        for size in args.sizes:
+            image = make_image(*parse_size(size))
+            summary, size_task_ids = await bench_upload(client, headers, image, size, args.files_per_upload,
+                                                        args.uploads, args.concurrency, args.poll_interval,
+                                                        args.warmup)
+            task_ids.extend(size_task_ids)
+            if 'upload' in args.scenarios:
+                results.append(summary)
+
+    if 'zip' in args.scenarios and task_ids:
+        results.append(await bench_zip(client, headers, task_ids, args.concurrency))
+    return results
+
+
+async def main(args):
+    if args.base_url:
+        async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout) as client:
+            return await run_scenarios(client, args)
+
+    from benchmarks.offline import configure_offline
+
+    configure_offline(args.workdir)
+
+    from app.main import app
+    from benchmarks.offline import celery_worker, create_schema
+
+    await create_schema()
+    with celery_worker(args.worker_concurrency):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench', timeout=args.timeout) as client:
+            return await run_scenarios(client, args)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Concurrent HTTP load test for login, upload and ZIP download")
+    parser.add_argument('--base-url', help="target a running API instead of the in-process offline stack")
+    parser.add_argument('--workdir', help="directory for the offline SQLite database and storage")
+    parser.add_argument('--scenarios', nargs='+', default=['login', 'upload', 'zip'])
+    parser.add_argument('--sizes', nargs='+', default=['1600x1200'])
+    parser.add_argument('--logins', type=int, default=50)
+    parser.add_argument('--uploads', type=int, default=20)
+    parser.add_argument('--files-per-upload', type=int, default=1)
+    parser.add_argument('--warmup', type=int, default=2, help="untimed uploads before each measured run")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--worker-concurrency', type=int, default=4)
+    parser.add_argument('--poll-interval', type=float, default=0.05)
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    results = asyncio.run(main(args))
+    for result in results:
+        print(' '.join(f"{name}={value:.1f}" if isinstance(value, float) else f"{name}={value}"
+                       for name, value in result.items()))
+    params = {name: value for name, value in vars(args).items() if name not in ('output', 'workdir')}
+    print(f"results written to {write_results(args.output, 'load', params, results)}")
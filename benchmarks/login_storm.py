@@ -0,0 +1,77 @@
+import argparse
+import asyncio
+import statistics
+import time
+from typing import List
+from uuid import uuid4
+import httpx
+from benchmarks.common import percentile
+
+
+async def login_storm(client: httpx.AsyncClient, email: str, password: str, logins: int, concurrency: int,
+                      statuses: List[int]):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def login():
+        async with semaphore:
+            response = await client.post("/login", data={"username": email, "password": password})
+            statuses.append(response.status_code)
+
+    await asyncio.gather(*(login() for _ in range(logins)))
+
+
+async def probe(client: httpx.AsyncClient, token: str, stop: asyncio.Event, latencies: List[float]):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await client.get("/get_my_id", headers={"Authorization": f"Bearer {token}"})
+        latencies.append(time.perf_counter() - started)
+        await asyncio.sleep(0.01)
+
+
+async def measure(client: httpx.AsyncClient, token: str, duration: float) -> List[float]:
+    stop = asyncio.Event()
+    latencies: List[float] = []
+    probe_task = asyncio.create_task(probe(client, token, stop, latencies))
+    await asyncio.sleep(duration)
+    stop.set()
+    await probe_task
+    return latencies
+
+
+def summary(latencies: List[float]) -> str:
+    return (f"n={len(latencies)} p50={statistics.median(latencies) * 1000:.1f}ms "
+            f"p99={percentile(latencies, 99) * 1000:.1f}ms")
+
+
+async def main(base_url: str, logins: int, concurrency: int):
+    email, password = f"{uuid4()}storm@example.com", "password"
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        response = await client.post("/registration", json={"email": email, "password": password})
+        response.raise_for_status()
+        token = response.json()["access_token"]
+
+        baseline = await measure(client, token, 2)
+
+        stop = asyncio.Event()
+        latencies: List[float] = []
+        statuses: List[int] = []
+        probe_task = asyncio.create_task(probe(client, token, stop, latencies))
+        started = time.perf_counter()
+        await login_storm(client, email, password, logins, concurrency, statuses)
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await probe_task
+
+    print(f"baseline     {summary(baseline)}")
+    print(f"during storm {summary(latencies)}")
+    print(f"logins: {logins} in {elapsed:.2f}s, "
+          f"ok={statuses.count(200)} shed={statuses.count(429)} other={len(statuses) - statuses.count(200) - statuses.count(429)}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measure unrelated endpoint latency during a login storm")
+    parser.add_argument('--base-url', default='http://localhost:8000')
+    parser.add_argument('--logins', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args.base_url, args.logins, args.concurrency))
@@ -0,0 +1,48 @@
+import os
+import tempfile
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+
+def configure_offline(workdir: Optional[str] = None) -> str:
+    workdir = workdir or tempfile.mkdtemp(prefix='image-bench-')
+    defaults = {
+        'DATABASE_URL': f"sqlite+aiosqlite:///{os.path.join(workdir, 'bench.db')}",
+        'STORAGE_BACKEND': 'local',
+        'LOCAL_STORAGE_PATH': os.path.join(workdir, 'storage'),
+        'CELERY_BROKER_URL': 'memory://',
+        'CELERY_RESULT_BACKEND': 'cache+memory://',
+        'SECRET_KEY': 'offline-benchmark-secret-key-0123456789',
+        'BCRYPT_ROUNDS': '10',
+        'DEDUP_ENABLED': '0',
+        'DERIVED_REDIS_URL': '',
+        'EVENTS_REDIS_URL': '',
+        'SCHEDULER_REDIS_URL': '',
+        'WORKER_METRICS_PORT': '0',
+    }
+    for name, value in defaults.items():
+        os.environ.setdefault(name, value)
+    return workdir
+
+
+async def create_schema():
+    from app.db import Base, get_engine
+
+    async with get_engine().begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+
+@contextmanager
+def celery_worker(concurrency: int) -> Iterator[None]:
+    from celery.contrib.testing.worker import start_worker
+    from app import worker
+    from app.scheduling import TASK_QUEUES
+    from app.tasks import celery_app
+
+    celery_app.conf.broker_transport_options = {'polling_interval': 0.01}
+    with start_worker(celery_app, pool='threads', concurrency=concurrency, perform_ping_check=False,
+                      queues=list(TASK_QUEUES), loglevel='WARNING'):
+        try:
+            yield
+        finally:
+            worker.stop_worker_loop()
@@ -0,0 +1,71 @@
+import argparse
+import os
+from typing import Any, Dict, List
+
+from benchmarks.offline import configure_offline
+
+configure_offline(os.environ.get('BENCH_WORKDIR'))
+
+from benchmarks.common import make_image, parse_size, summarize, timeit, write_results  # noqa: E402
+from app.image_processing import convert_image_to_bytes, decode_image  # noqa: E402
+from app.schemas import TransformSpec  # noqa: E402
+from app.imaging import apply_transform  # noqa: E402
+from app.transforms import (ENCODER_PRESETS, VARIANTS, codec_available, encoder_options,  # noqa: E402
+                            is_identity)
+
+DEFAULT_SIZES = ['640x480', '1600x1200']
+
+
+def bench_source(width: int, height: int, source_format: str, variants: List[str], output_formats: List[str],
+                 presets: List[str], repeat: int) -> List[Dict[str, Any]]:
+    source = make_image(width, height, source_format)
+    common = {'size': f"{width}x{height}", 'source_format': source_format}
+    results = [{'stage': 'decode', **common, **summarize(timeit(lambda: decode_image(source), repeat))}]
+
+    image = decode_image(source)
+    for variant in variants:
+        spec = VARIANTS[variant]
+        samples = timeit(lambda: apply_transform(image, spec), repeat)
+        results.append({'stage': 'transform', 'variant': variant, **common, **summarize(samples)})
+
+    for output_format in output_formats:
+        for preset in presets:
+            options = encoder_options(TransformSpec(), output_format, preset)
+            encode_source = image.convert('RGB') if image.mode not in ('RGB', 'L') else image
+            output_size = len(convert_image_to_bytes(encode_source, output_format, **options).getvalue())
+            samples = timeit(lambda: convert_image_to_bytes(encode_source, output_format, **options), repeat)
+            results.append({'stage': 'encode', 'output_format': output_format, 'preset': preset,
+                            'output_bytes': output_size, **common, **summarize(samples)})
+    return results
+
+
+def main(sizes: List[str], source_formats: List[str], variants: List[str], output_formats: List[str],
+         presets: List[str], repeat: int, output: str):
+    output_formats = [image_format for image_format in output_formats if codec_available(image_format)]
+    results = []
+    for size in sizes:
+        for source_format in source_formats:
+            results.extend(bench_source(*parse_size(size), source_format, variants, output_formats, presets, repeat))
+
+    for result in results:
+        label = result.get('variant') or f"{result.get('output_format', '')} {result.get('preset', '')}".strip()
+        print(f"{result['size']:>10} {result['source_format']:<5} {result['stage']:<9} {label:<18} "
+              f"p50={result['p50_ms']:8.1f}ms p99={result['p99_ms']:8.1f}ms")
+
+    params = {'sizes': sizes, 'source_formats': source_formats, 'variants': variants,
+              'output_formats': output_formats, 'presets': presets, 'repeat': repeat}
+    print(f"results written to {write_results(output, 'stages', params, results)}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Micro-benchmark decode, transform and encode stages")
+    parser.add_argument('--sizes', nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--source-formats', nargs='+', default=['JPEG', 'PNG'])
+    parser.add_argument('--variants', nargs='+',
+                        default=[name for name, spec in VARIANTS.items() if not is_identity(spec)])
+    parser.add_argument('--output-formats', nargs='+', default=['JPEG', 'PNG', 'WEBP', 'AVIF'])
+    parser.add_argument('--presets', nargs='+', default=list(ENCODER_PRESETS))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+    main(args.sizes, args.source_formats, args.variants, args.output_formats, args.presets, args.repeat, args.output)
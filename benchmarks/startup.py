@@ -0,0 +1,117 @@
+import argparse
+import asyncio
+import socket
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Tuple
+import httpx
+from benchmarks.common import summarize, write_results
+from benchmarks.offline import configure_offline, create_schema
+
+HEAVY_MODULES = ('PIL', 'boto3', 'botocore', 'asyncpg', 'numpy')
+
+IMPORT_MODULE = """
+import sys, time
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+print(elapsed, ','.join(name for name in {heavy!r} if name in sys.modules))
+"""
+
+
+def import_time(module: str, repeat: int) -> Tuple[List[float], List[str]]:
+    samples, heavy = [], []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, '-c', IMPORT_MODULE.format(module=module, heavy=HEAVY_MODULES)],
+                                capture_output=True, text=True, check=True)
+        elapsed, _, loaded = result.stdout.strip().partition(' ')
+        samples.append(float(elapsed))
+        heavy = [name for name in loaded.split(',') if name]
+    return samples, heavy
+
+
+def import_profile(module: str, top: int) -> List[Tuple[str, float]]:
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+                            capture_output=True, text=True, check=True)
+    packages = defaultdict(float)
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        packages[name.strip().split('.')[0]] += int(self_us)
+    return sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def first_requests(paths: List[str], timeout: float) -> Dict[str, float]:
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    server = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'app.main:app', '--host', '127.0.0.1',
+                               '--port', str(port), '--log-level', 'warning'])
+    timings = {}
+    try:
+        async with httpx.AsyncClient(base_url=base_url) as client:
+            while 'ready' not in timings:
+                if server.poll() is not None:
+                    raise RuntimeError(f"uvicorn exited with {server.returncode}")
+                if time.perf_counter() - started > timeout:
+                    raise TimeoutError(f"API did not come up within {timeout:.0f}s")
+                try:
+                    await client.get('/metrics')
+                except httpx.TransportError:
+                    await asyncio.sleep(0.01)
+                    continue
+                timings['ready'] = time.perf_counter() - started
+            for path in paths:
+                request_started = time.perf_counter()
+                await client.post(path, data={'username': 'startup@example.com', 'password': 'password'})
+                timings[path] = time.perf_counter() - request_started
+    finally:
+        server.terminate()
+        server.wait()
+    return timings
+
+
+def main(modules: List[str], repeat: int, top: int, paths: List[str], timeout: float,
+         output: str = None) -> None:
+    workdir = configure_offline()
+    asyncio.run(create_schema())
+    results: List[Dict[str, Any]] = []
+
+    for module in modules:
+        samples, heavy = import_time(module, repeat)
+        results.append({'stage': 'import', 'module': module, 'heavy_modules_count': len(heavy),
+                        **summarize(samples)})
+        print(f"import {module}: p50 {results[-1]['p50_ms']:.0f} ms, heavy: {', '.join(heavy) or 'none'}")
+        for package, self_us in import_profile(module, top):
+            results.append({'stage': 'import_package', 'module': module, 'package': package,
+                            'self_ms': self_us / 1000})
+            print(f"    {package:<24} {self_us / 1000:8.1f} ms")
+
+    runs = [asyncio.run(first_requests(paths, timeout)) for _ in range(repeat)]
+    for name in ['ready', *paths]:
+        results.append({'stage': 'first_request', 'path': name, **summarize([run[name] for run in runs])})
+        print(f"first request {name}: p50 {results[-1]['p50_ms']:.0f} ms")
+
+    params = {'modules': modules, 'repeat': repeat, 'top': top, 'paths': paths, 'workdir': workdir}
+    print(f"Results written to {write_results(output, 'startup', params, results)}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measure API and worker import time and time to first request")
+    parser.add_argument('--modules', nargs='+', default=['app.main', 'app.tasks', 'app.image_processing'])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--paths', nargs='+', default=['/login'])
+    parser.add_argument('--timeout', type=float, default=30.0)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+    main(args.modules, args.repeat, args.top, args.paths, args.timeout, args.output)
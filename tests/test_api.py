@@ -1,7 +1,22 @@
+import asyncio
+import threading
 import pytest
 import httpx
 from io import BytesIO
 from uuid import uuid4
+from PIL import Image
+from app import security
+from app.db import save_tasks_to_db
+from app.schemas import TaskToDatabase
+from app.storage import get_storage
+
+
+def make_image_bytes(name: str = "test.jpg", image_format: str = "JPEG") -> BytesIO:
+    image_bytes = BytesIO()
+    Image.new("RGB", (64, 48), "red").save(image_bytes, format=image_format)
+    image_bytes.seek(0)
+    image_bytes.name = name
+    return image_bytes
 
 
 async def register_user(async_client: httpx.AsyncClient) -> dict[str, str]:
@@ -15,6 +30,15 @@ async def register_user(async_client: httpx.AsyncClient) -> dict[str, str]:
     return {"token": token, "login": f"{random_uuid}testuser@example.com"}
 
 
+async def create_finished_task(async_client: httpx.AsyncClient, auth_token: str) -> tuple[str, str]:
+    response = await async_client.get("/get_my_id", headers={"Authorization": f"Bearer {auth_token}"})
+    task_id = str(uuid4())
+    img_link = f"{task_id}_original.jpeg"
+    await get_storage().put(img_link, make_image_bytes().getvalue())
+    await save_tasks_to_db(TaskToDatabase(task_id=task_id, image_links=[img_link], user_id=response.json()["your_id"]))
+    return task_id, img_link
+
+
 @pytest.mark.asyncio
 async def test_registration(async_client: httpx.AsyncClient):
     registration_info = await register_user(async_client)
@@ -35,13 +59,39 @@ async def test_login(async_client: httpx.AsyncClient):
     assert response.status_code == 200
 
 
+@pytest.mark.asyncio
+async def test_login_sheds_load_when_auth_queue_is_full(async_client: httpx.AsyncClient, monkeypatch):
+    registration_info = await register_user(async_client)
+    credentials = {"username": registration_info["login"], "password": "password"}
+    release = threading.Event()
+    verify_password = security.verify_password
+
+    def blocked_verify_password(password: str, hashed_password: str) -> bool:
+        release.wait(10)
+        return verify_password(password, hashed_password)
+
+    monkeypatch.setattr(security, "AUTH_QUEUE_LIMIT", 2)
+    monkeypatch.setattr(security, "verify_password", blocked_verify_password)
+    async def fill_queue():
+        while security._auth_pending < 2:
+            await asyncio.sleep(0.01)
+
+    queued = [asyncio.create_task(async_client.post("/login", data=credentials)) for _ in range(2)]
+    await asyncio.wait_for(fill_queue(), 5)
+
+    response = await async_client.post("/login", data=credentials)
+    release.set()
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "1"
+    assert [r.status_code for r in await asyncio.gather(*queued)] == [200, 200]
+
+
 @pytest.mark.asyncio
 async def test_upload_images(async_client: httpx.AsyncClient):
     registration_info = await register_user(async_client)
     auth_token = registration_info["token"]
 
-    image_bytes = BytesIO(b"fake image data")
-    image_bytes.name = "test.jpg"
+    image_bytes = make_image_bytes()
     response = await async_client.post(
         "/upload",
         files={"files": ("test.jpg", image_bytes, "image/jpeg")},
@@ -58,8 +108,7 @@ async def test_get_status(async_client: httpx.AsyncClient):
     user_login = registration_info["login"]
     auth_token = registration_info["token"]
 
-    image_bytes = BytesIO(b"fake image data")
-    image_bytes.name = "test.jpg"
+    image_bytes = make_image_bytes()
     upload_response = await async_client.post(
         "/upload",
         files={"files": ("test.jpg", image_bytes, "image/jpeg")},
@@ -78,6 +127,32 @@ async def test_get_status(async_client: httpx.AsyncClient):
     assert task_status is not None
 
 
+@pytest.mark.asyncio
+async def test_get_bulk_status(async_client: httpx.AsyncClient):
+    registration_info = await register_user(async_client)
+    auth_token = registration_info["token"]
+
+    image_bytes = make_image_bytes()
+    upload_response = await async_client.post(
+        "/upload",
+        files={"files": ("test.jpg", image_bytes, "image/jpeg")},
+        headers={"Authorization": f"Bearer {auth_token}"}
+    )
+    assert upload_response.status_code == 200
+    task_id = upload_response.json().get("task_id")
+    unknown_task_id = str(uuid4())
+
+    status_response = await async_client.post(
+        "/status",
+        json={"task_ids": [task_id, unknown_task_id]},
+        headers={"Authorization": f"Bearer {auth_token}"}
+    )
+    assert status_response.status_code == 200
+    statuses = status_response.json()
+    assert statuses[task_id].get("task_status") is not None
+    assert statuses[unknown_task_id].get("task_status") == "PENDING"
+
+
 @pytest.mark.asyncio
 async def test_get_my_id(async_client: httpx.AsyncClient):
     registration_info = await register_user(async_client)
@@ -98,8 +173,7 @@ async def test_get_history(async_client: httpx.AsyncClient):
     registration_info = await register_user(async_client)
     auth_token = registration_info["token"]
 
-    image_bytes = BytesIO(b"fake image data")
-    image_bytes.name = "test.jpg"
+    image_bytes = make_image_bytes()
     upload_response = await async_client.post(
         "/upload",
         files={"files": ("test.jpg", image_bytes, "image/jpeg")},
@@ -118,13 +192,49 @@ async def test_get_history(async_client: httpx.AsyncClient):
     assert task_status is not None
 
 
+@pytest.mark.asyncio
+async def test_get_history_pages(async_client: httpx.AsyncClient):
+    registration_info = await register_user(async_client)
+    headers = {"Authorization": f"Bearer {registration_info['token']}"}
+    user_id = (await async_client.get("/get_my_id", headers=headers)).json()["your_id"]
+    img_links = set()
+    for _ in range(2):
+        task_id = str(uuid4())
+        links = [f"{task_id}_{index}.jpeg" for index in range(3)]
+        await save_tasks_to_db(TaskToDatabase(task_id=task_id, image_links=links, user_id=user_id))
+        img_links.update(links)
+
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        response = await async_client.get(f"/history/{user_id}", params=params, headers=headers)
+        assert response.status_code == 200
+        page = response.json()
+        assert len(page) <= 2
+        seen.extend(row["img_link"] for row in page)
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+    assert len(seen) == len(img_links)
+    assert set(seen) == img_links
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("cursor", ["not-a-cursor", "bm8tc2VwYXJhdG9y", "bm90LWEtZGF0ZXxpZA=="])
+async def test_get_history_rejects_bad_cursor(async_client: httpx.AsyncClient, cursor: str):
+    registration_info = await register_user(async_client)
+    headers = {"Authorization": f"Bearer {registration_info['token']}"}
+    user_id = (await async_client.get("/get_my_id", headers=headers)).json()["your_id"]
+    response = await async_client.get(f"/history/{user_id}", params={"cursor": cursor}, headers=headers)
+    assert response.status_code == 400
+
+
 @pytest.mark.asyncio
 async def test_download_task_images(async_client: httpx.AsyncClient):
     registration_info = await register_user(async_client)
     auth_token = registration_info["token"]
 
-    image_bytes = BytesIO(b"fake image data")
-    image_bytes.name = "test.jpg"
+    image_bytes = make_image_bytes()
     upload_response = await async_client.post(
         "/upload",
         files={"files": ("test.jpg", image_bytes, "image/jpeg")},
@@ -141,3 +251,77 @@ async def test_download_task_images(async_client: httpx.AsyncClient):
     assert download_response.headers["Content-Type"] == "application/zip"
     assert "Content-Disposition" in download_response.headers
     assert download_response.headers["Content-Disposition"] == f"attachment; filename={task_id}.zip"
+
+
+@pytest.mark.asyncio
+async def test_get_task_image_urls_unknown_task(async_client: httpx.AsyncClient):
+    registration_info = await register_user(async_client)
+    auth_token = registration_info["token"]
+
+    response = await async_client.get(
+        f"/task/{uuid4()}/urls",
+        headers={"Authorization": f"Bearer {auth_token}"}
+    )
+    assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_download_unknown_image(async_client: httpx.AsyncClient):
+    registration_info = await register_user(async_client)
+    auth_token = registration_info["token"]
+
+    response = await async_client.get(
+        f"/image/{uuid4()}_original.jpeg",
+        headers={"Authorization": f"Bearer {auth_token}"}
+    )
+    assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_upload_rejects_invalid_image(async_client: httpx.AsyncClient):
+    registration_info = await register_user(async_client)
+    auth_token = registration_info["token"]
+
+    image_bytes = BytesIO(b"fake image data")
+    image_bytes.name = "test.jpg"
+    response = await async_client.post(
+        "/upload",
+        files={"files": ("test.jpg", image_bytes, "image/jpeg")},
+        headers={"Authorization": f"Bearer {auth_token}"}
+    )
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("path", ["/task/{task_id}", "/image/{img_link}"])
+async def test_download_conditional_and_range_requests(async_client: httpx.AsyncClient, path: str):
+    registration_info = await register_user(async_client)
+    auth_token = registration_info["token"]
+    task_id, img_link = await create_finished_task(async_client, auth_token)
+    url = path.format(task_id=task_id, img_link=img_link)
+    headers = {"Authorization": f"Bearer {auth_token}"}
+
+    response = await async_client.get(url, headers=headers)
+    assert response.status_code == 200
+    if path.startswith("/task"):
+        streamed = response.content
+        response = await async_client.get(url, headers=headers)
+        assert response.status_code == 200
+        assert response.content == streamed
+    assert response.headers["Accept-Ranges"] == "bytes"
+    assert "Cache-Control" in response.headers
+    assert "Last-Modified" in response.headers
+    etag = response.headers["ETag"]
+    body = response.content
+
+    response = await async_client.get(url, headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+
+    response = await async_client.get(url, headers={**headers, "Range": "bytes=0-9", "If-Range": etag})
+    assert response.status_code == 206
+    assert response.headers["Content-Range"] == f"bytes 0-9/{len(body)}"
+    assert response.content == body[:10]
+
+    response = await async_client.get(url, headers={**headers, "Range": f"bytes={len(body)}-"})
+    assert response.status_code == 416
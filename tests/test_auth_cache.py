@@ -0,0 +1,58 @@
+import asyncio
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from app import auth_cache
+from app.db import Base, User
+from app.schemas import CurrentUser
+
+
+def test_cache_hit_and_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(auth_cache.time, 'monotonic', lambda: now[0])
+    monkeypatch.setattr(auth_cache, '_local', auth_cache.TTLCache(10, 30))
+    principal = CurrentUser(id="user-1", email="user@example.com")
+
+    async def lookup() -> CurrentUser:
+        return await auth_cache.get_principal("user-1")
+
+    asyncio.run(auth_cache.set_principal(principal))
+    now[0] += 29
+    assert asyncio.run(lookup()) == principal
+    now[0] += 2
+    assert asyncio.run(lookup()) is None
+
+
+def test_cache_evicts_least_recently_used():
+    cache = auth_cache.TTLCache(2, 30)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == (1, None, 3)
+
+
+def test_user_update_drops_cached_principal(monkeypatch):
+    monkeypatch.setattr(auth_cache, '_local', auth_cache.TTLCache(10, 30))
+
+    async def update_user():
+        engine = create_async_engine("sqlite+aiosqlite://")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        session_factory = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+        async with session_factory() as db:
+            db.add(User(id="user-1", email="old@example.com", password="hash"))
+            await db.commit()
+        await auth_cache.set_principal(CurrentUser(id="user-1", email="old@example.com"))
+        assert await auth_cache.get_principal("user-1") is not None
+
+        async with session_factory() as db:
+            user = (await db.execute(select(User).filter_by(id="user-1"))).scalar_one()
+            user.email = "new@example.com"
+            await db.commit()
+        cached = await auth_cache.get_principal("user-1")
+        await asyncio.gather(*auth_cache._pending_invalidations)
+        await engine.dispose()
+        return cached
+
+    assert asyncio.run(update_user()) is None
@@ -0,0 +1,25 @@
+import asyncio
+from io import BytesIO
+from PIL import Image
+from app import derived
+from app.storage import LocalStorage, configure_storage
+
+
+def test_missing_derived_object_is_rendered_again(tmp_path, monkeypatch):
+    monkeypatch.setattr(derived, 'DERIVED_REDIS_URL', None)
+    monkeypatch.setattr(derived, '_memory', derived.ByteLRU(0))
+    storage = configure_storage(LocalStorage(str(tmp_path)))
+    source = BytesIO()
+    Image.new('RGB', (640, 480), 'red').save(source, 'JPEG')
+
+    async def fetch_twice():
+        await storage.put('source.jpeg', source.getvalue())
+        key, first = await derived.get_variant('source.jpeg', 'thumbnail')
+        await storage.delete(key)
+        _, second = await derived.get_variant('source.jpeg', 'thumbnail')
+        return key, first, second, await storage.get_if_exists(key)
+
+    key, first, second, stored = asyncio.run(fetch_twice())
+    assert first == second == stored
+    assert Image.open(BytesIO(first)).width <= 640
+    assert derived.get_render_budget().used == 0
@@ -0,0 +1,47 @@
+from datetime import datetime, timezone
+import pytest
+from fastapi import HTTPException
+from app.http_cache import http_date, is_not_modified, parse_range, requested_range
+from app.storage import ObjectInfo
+
+INFO = ObjectInfo("image.jpeg", 1000, '"abc"', datetime(2024, 5, 1, 12, 0, 0, 500000, tzinfo=timezone.utc))
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", (0, 99)),
+    ("bytes=900-", (900, 999)),
+    ("bytes=900-5000", (900, 999)),
+    ("bytes=-100", (900, 999)),
+    ("bytes=-5000", (0, 999)),
+    ("bytes=5-1", None),
+    ("bytes=0-1,5-9", None),
+    ("items=0-1", None),
+    ("bytes=-", None),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=-0"])
+def test_parse_range_not_satisfiable(header):
+    with pytest.raises(HTTPException) as error:
+        parse_range(header, 1000)
+    assert error.value.status_code == 416
+    assert error.value.headers["Content-Range"] == "bytes */1000"
+
+
+def test_conditional_requests():
+    last_modified = http_date(INFO.last_modified)
+    assert last_modified == "Wed, 01 May 2024 12:00:00 GMT"
+    assert is_not_modified({"if-none-match": 'W/"abc"'}, INFO)
+    assert is_not_modified({"if-none-match": '"other", "abc"'}, INFO)
+    assert not is_not_modified({"if-none-match": '"other"', "if-modified-since": last_modified}, INFO)
+    assert is_not_modified({"if-modified-since": last_modified}, INFO)
+    assert not is_not_modified({"if-modified-since": "Wed, 01 May 2024 11:59:59 GMT"}, INFO)
+
+
+def test_if_range():
+    assert requested_range({"range": "bytes=0-9", "if-range": '"abc"'}, INFO) == (0, 9)
+    assert requested_range({"range": "bytes=0-9", "if-range": 'W/"abc"'}, INFO) is None
+    assert requested_range({"range": "bytes=0-9", "if-range": "Wed, 01 May 2024 12:00:00 GMT"}, INFO) == (0, 9)
+    assert requested_range({"range": "bytes=0-9", "if-range": "Tue, 30 Apr 2024 12:00:00 GMT"}, INFO) is None
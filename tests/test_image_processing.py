@@ -0,0 +1,60 @@
+import json
+import os
+import subprocess
+import sys
+from PIL import Image
+
+PROCESS_IMAGE = """
+import asyncio, json, os, sys
+import billiard
+from PIL import Image
+from app import image_processing
+
+def process(path):
+    file_bytes = open(path, 'rb').read()
+    names = asyncio.run(image_processing.process_and_upload_image(file_bytes, 'pooled'))
+    sizes = {name: Image.open(os.path.join(os.environ['LOCAL_STORAGE_PATH'], name)).size for name in names}
+    return {'sizes': sizes, 'process_pool': image_processing._process_pool is not None}
+
+if __name__ == '__main__':
+    if sys.argv[2] == 'prefork':
+        with billiard.Pool(1) as pool:
+            result = pool.apply(process, (sys.argv[1],))
+    else:
+        result = process(sys.argv[1])
+    print(json.dumps(result))
+"""
+
+EXPECTED_SIZES = {
+    "pooled_original.jpeg": [640, 480],
+    "pooled_rotated.jpeg": [480, 640],
+    "pooled_gray.jpeg": [640, 480],
+    "pooled_scaled.jpeg": [320, 240],
+}
+
+
+def run_process_image(tmp_path, mode: str) -> dict:
+    source = str(tmp_path / "source.jpg")
+    gradient = Image.linear_gradient("L").resize((640, 480))
+    Image.merge("RGB", (gradient, gradient, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT))).save(source)
+    script = tmp_path / "process_image.py"
+    script.write_text(PROCESS_IMAGE)
+    root = os.path.dirname(os.path.dirname(__file__))
+    env = dict(os.environ, STORAGE_BACKEND="local", LOCAL_STORAGE_PATH=str(tmp_path / "storage"),
+               IMAGE_PROCESS_POOL_PIXELS="1", IMAGE_PROCESS_POOL_WORKERS="2",
+               PYTHONPATH=os.pathsep.join(filter(None, [root, os.environ.get("PYTHONPATH")])))
+    result = subprocess.run([sys.executable, str(script), source, mode], env=env, capture_output=True,
+                            text=True, check=True, cwd=root, timeout=120)
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def test_large_images_render_in_process_pool(tmp_path):
+    output = run_process_image(tmp_path, "direct")
+    assert output["process_pool"] is True
+    assert output["sizes"] == EXPECTED_SIZES
+
+
+def test_prefork_children_render_in_threads(tmp_path):
+    output = run_process_image(tmp_path, "prefork")
+    assert output["process_pool"] is False
+    assert output["sizes"] == EXPECTED_SIZES
@@ -0,0 +1,67 @@
+import json
+import os
+import subprocess
+import sys
+from PIL import Image, ImageChops
+from app import tiling
+from app.schemas import TransformSpec
+from app.imaging import apply_transform
+from app.transforms import VARIANTS
+
+MEMORY_BUDGET = 512 * 1024 * 1024
+
+PROCESS_IMAGE = """
+import asyncio, json, os, sys
+from PIL import Image
+from app.image_processing import process_and_upload_image
+
+def memory(field):
+    with open('/proc/self/status') as status:
+        return next(int(line.split()[1]) * 1024 for line in status if line.startswith(field))
+
+file_bytes = open(sys.argv[1], 'rb').read()
+baseline = memory('VmRSS:')
+names = asyncio.run(process_and_upload_image(file_bytes, 'huge'))
+growth = memory('VmHWM:') - baseline
+sizes = {name: Image.open(os.path.join(os.environ['LOCAL_STORAGE_PATH'], name)).size for name in names}
+print(json.dumps({'growth': growth, 'sizes': sizes}))
+"""
+
+
+def make_huge_image(path: str, width: int, height: int):
+    gradient = Image.linear_gradient("L").resize((width, height))
+    radial = Image.radial_gradient("L").resize((width, height))
+    Image.merge("RGB", (gradient, radial, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT))).save(path, quality=90)
+
+
+def test_render_tiled_matches_whole_image(monkeypatch):
+    monkeypatch.setattr(tiling, "TILED_STRIP_BYTES", 16 * 1024)
+    gradient = Image.linear_gradient("L").resize((517, 389))
+    image = Image.merge("RGB", (gradient, gradient.transpose(Image.Transpose.ROTATE_180), gradient))
+    specs = [VARIANTS["rotated"], VARIANTS["gray"], VARIANTS["scaled"], VARIANTS["thumbnail"],
+             TransformSpec(crop=(20, 10, 400, 300), rotate=270, size=(128, 128), grayscale=True)]
+    for spec in specs:
+        expected, tiled = apply_transform(image, spec), tiling.render_tiled(image, spec)
+        assert tiled.size == expected.size
+        assert tiled.mode == expected.mode
+        difference = ImageChops.difference(expected.convert("RGB"), tiled.convert("RGB"))
+        assert max(high for _, high in difference.getextrema()) <= 4
+
+
+def test_huge_image_stays_within_memory_budget(tmp_path):
+    source = str(tmp_path / "huge.jpg")
+    make_huge_image(source, 8000, 6000)
+    env = dict(os.environ, STORAGE_BACKEND="local", LOCAL_STORAGE_PATH=str(tmp_path / "storage"),
+               IMAGE_MEMORY_BUDGET=str(MEMORY_BUDGET), IMAGE_PROCESS_POOL_PIXELS=str(10 ** 9),
+               MALLOC_MMAP_THRESHOLD_="131072")
+    result = subprocess.run([sys.executable, "-c", PROCESS_IMAGE, source], env=env, capture_output=True,
+                            text=True, check=True, cwd=os.path.dirname(os.path.dirname(__file__)))
+    output = json.loads(result.stdout.splitlines()[-1])
+
+    assert output["growth"] <= MEMORY_BUDGET
+    assert output["sizes"] == {
+        "huge_original.jpeg": [8000, 6000],
+        "huge_rotated.jpeg": [6000, 8000],
+        "huge_gray.jpeg": [8000, 6000],
+        "huge_scaled.jpeg": [4000, 3000],
+    }
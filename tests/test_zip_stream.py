@@ -0,0 +1,62 @@
+import asyncio
+import struct
+import zipfile
+from datetime import datetime
+from io import BytesIO
+from typing import List, Tuple
+from app import zip_stream
+
+MODIFIED = datetime(2024, 5, 1, 12, 30, 44)
+
+
+def build_zip(files: List[Tuple[str, bytes]]) -> bytes:
+    async def source():
+        for name, data in files:
+            yield name, data
+
+    async def collect():
+        return b''.join([chunk async for chunk in zip_stream.stream_zip(source(), MODIFIED)])
+
+    return asyncio.run(collect())
+
+
+def test_zip_round_trip():
+    files = [
+        ("photo.jpeg", bytes(range(256)) * 1000),
+        ("notes.txt", b"compressible " * 10000),
+        ("фото_😀.png", b"\x89PNG" * 10),
+        ("empty.jpeg", b""),
+        ("empty.txt", b""),
+    ]
+    archive = zipfile.ZipFile(BytesIO(build_zip(files)))
+    assert archive.testzip() is None
+    assert [info.filename for info in archive.infolist()] == [name for name, _ in files]
+    for info, (name, data) in zip(archive.infolist(), files):
+        assert archive.read(name) == data
+        assert info.date_time == (2024, 5, 1, 12, 30, 44)
+        expected = zipfile.ZIP_STORED if name.endswith(('.jpeg', '.png')) else zipfile.ZIP_DEFLATED
+        assert info.compress_type == expected
+        assert info.flag_bits & 0x800
+    assert archive.getinfo("notes.txt").compress_size < len(files[1][1])
+
+
+def test_zip_is_deterministic():
+    files = [("a.jpeg", b"a" * 100), ("b.txt", b"b" * 100)]
+    assert build_zip(files) == build_zip(files)
+
+
+def test_zip64_entry_count():
+    files = [(f"{index}.txt", b"") for index in range(0xFFFF + 1)]
+    archive = zipfile.ZipFile(BytesIO(build_zip(files)))
+    assert len(archive.infolist()) == len(files)
+    assert archive.read("65535.txt") == b""
+
+
+def test_zip64_offset_in_central_header():
+    offset = 5 * 1024 ** 3
+    entry = zip_stream._Entry(b"late.jpeg", zipfile.ZIP_STORED, 0x800, 0, 10, 10, offset)
+    header = entry.central_header(0, 0)
+    fields = struct.unpack('<IHHHHHHIIIHHHHHII', header[:46])
+    assert fields[1] == fields[2] == 45
+    assert fields[11] == 12 and fields[16] == 0xFFFFFFFF
+    assert struct.unpack('<HHQ', header[46 + len(b"late.jpeg"):]) == (0x0001, 8, offset)